@@ -1,10 +1,45 @@
+import cProfile
+import multiprocessing
+import os
+import pstats
+import queue
 import random
+import time
+from array import array
+import ChessBook, ChessTablebase
 
 pieceValues = {'K' : 0, 'P' : 1, 'N' : 3, 'B' : 3, 'R' : 5, 'Q' : 9}
 CHECKMATE = 10000
+MATE_SCORE = CHECKMATE - 1000 # A mate scores CHECKMATE less its plies from the root, so every score beyond this is a forced mate
 DRAW = 0
 STALEMATE = 0
-DEPTH = 4
+DEPTH = 4 # Depth searched when getBestMove gets no time or node budget
+MAX_DEPTH = 64 # Deepest iteration searched with a budget
+TT_SIZE_MB = 16 # Memory for the transposition table
+WORKERS = multiprocessing.cpu_count() # Processes used by getBestMoveParallel by default, each with its own transposition table
+DEBUG_EVAL = False # Check the running evaluation against a full rescan of the board at every leaf
+CHECK_EVERY = 256 # Nodes searched between checks of the time and node budget
+DELTA_MARGIN = 2 # Quiescence skips captures that can't raise alpha even when winning this much more than the captured piece
+NULL_WINDOW = 0.01 # Width of the window that only tells whether a move beats alpha, scores are multiples of 0.05
+ASPIRATION_WINDOW = 0.5 # Each iteration from ASPIRATION_DEPTH on first searches this far around the score of the one before
+ASPIRATION_DEPTH = 3
+USE_BOOK = True # Play from the opening book while the position is in it, before searching
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.bin')
+USE_TABLEBASES = True # Take the result of positions with few pieces from the endgame tablebases instead of searching them
+PROFILE_SEARCH = None # 'timers' times move generation, make/undo and evaluation with perf_counter, 'cprofile' runs the search under cProfile. Both slow it down
+PROFILE_TOP = 25 # Functions listed in the report of a cProfile run
+TB_WIN = 5000 # Score of a tablebase win less its plies to mate, so the quickest mate scores highest. Below CHECKMATE, a mate on the board is still better
+
+# Move ordering scores, every capture is tried before the killers and every killer before the other quiet moves
+TT_MOVE_SCORE = 10000000
+CAPTURE_SCORE = 1000000
+KILLER_SCORES = (900000, 800000)
+HISTORY_MAX = 500000 # History scores are halved once one reaches this, so they stay below the killers
+
+# Transposition table score bounds
+EXACT = 0
+LOWER_BOUND = 1 # Search failed high, the score is at least this
+UPPER_BOUND = 2 # No move raised alpha, the score is at most this
 
 knightPositionValues = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
                         [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
@@ -62,6 +97,153 @@ piecePostitionValues = {"wN": knightPositionValues,
                          "wP": pawnPositionValues,
                          "bP": pawnPositionValues[::-1]}
 
+'''
+Score of every piece on every square (row * 8 + col) from pieceValues and piecePostitionValues, positive is good for white.
+GameState keeps the sum of these up to date as moves are made
+'''
+def buildPieceSquareScores():
+    squareScores = {}
+    for color, sign in (('w', 1), ('b', -1)):
+        for pieceType in pieceValues:
+            piece = color + pieceType
+            squareScores[piece] = [sign * (pieceValues[pieceType] + (piecePostitionValues[piece][sq // 8][sq % 8] if pieceType != 'K' else 0))
+                                   for sq in range(64)]
+    return squareScores
+
+pieceSquareScores = buildPieceSquareScores()
+
+'''
+Fixed-size table of searched positions, indexed by the low bits of the Zobrist key.
+Entries are kept in flat arrays, so the table never grows past its size however long the game runs
+'''
+class TranspositionTable():
+    ENTRY_BYTES = 23 # Key 8, score 8, move 4, depth 1, flag 1, age 1
+
+    def __init__(self, sizeMB=TT_SIZE_MB):
+        self.size = 1
+        while self.size * 2 * self.ENTRY_BYTES <= sizeMB * 1024 * 1024:
+            self.size *= 2
+        self.mask = self.size - 1
+        self.clear()
+
+    def clear(self):
+        self.keys = array('Q', bytes(8 * self.size))
+        self.scores = array('d', bytes(8 * self.size))
+        self.moves = array('i', bytes(4 * self.size)) # moveID of the best move, -1 when there was none
+        self.depths = array('b', [-1]) * self.size # -1 marks an empty slot
+        self.flags = array('B', bytes(self.size))
+        self.ages = array('B', bytes(self.size))
+        self.age = 0
+        self.resetCounters()
+
+    def resetCounters(self):
+        self.probes = 0
+        self.hits = 0
+        self.cutoffs = 0
+        self.stores = 0
+        self.overwrites = 0 # Entries of another position replaced
+
+    '''
+    Start a new search, entries of earlier searches are replaced first
+    '''
+    def newSearch(self):
+        self.age = (self.age + 1) & 255
+
+    '''
+    Return (depth, score, flag, moveID) stored for the key, or None
+    '''
+    def probe(self, key):
+        self.probes += 1
+        i = key & self.mask
+        if self.keys[i] == key and self.depths[i] >= 0:
+            self.hits += 1
+            return self.depths[i], self.scores[i], self.flags[i], self.moves[i]
+        return None
+
+    '''
+    Store a search result. A slot is replaced when it is empty, holds the same position, is from an earlier search,
+    or was searched no deeper than the new result
+    '''
+    def store(self, key, depth, score, flag, moveID):
+        i = key & self.mask
+        if self.depths[i] >= 0 and self.keys[i] != key:
+            if self.ages[i] == self.age and self.depths[i] > depth:
+                return # Keep the deeper result of this search
+            self.overwrites += 1
+        elif moveID < 0 and self.keys[i] == key:
+            moveID = self.moves[i] # Keep the best move found by an earlier search of the position
+        self.keys[i] = key
+        self.scores[i] = score
+        self.moves[i] = moveID
+        self.depths[i] = depth
+        self.flags[i] = flag
+        self.ages[i] = self.age
+        self.stores += 1
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    '''
+    Fraction of a sample of slots used by the current search
+    '''
+    def usage(self, sample=1000):
+        step = max(1, self.size // sample)
+        used = sum(1 for i in range(0, self.size, step) if self.depths[i] >= 0 and self.ages[i] == self.age)
+        return used / len(range(0, self.size, step))
+
+    def stats(self):
+        return {'size': self.size, 'probes': self.probes, 'hits': self.hits, 'hitRate': self.hitRate(),
+                'cutoffs': self.cutoffs, 'stores': self.stores, 'overwrites': self.overwrites, 'usage': self.usage()}
+
+tt = TranspositionTable()
+stopRequested = None # Function polled with the budget, the search stops early once it returns True. Used to cancel a search
+sharedRootScores = None # Best root score of the other workers at every depth, in a worker of the parallel search
+ownRootScores = None # Best exact root score this worker published at every depth
+openingBook = None # Opened on the first lookup
+principalVariation = [] # Moves the last search expects, set by iterativeDeepening
+rootPly = 0 # Moves played before the root of the running search, mate scores count their plies from it
+tablebases = ChessTablebase.Tablebases() # Tables are opened on the first probe of their material
+
+'''
+Move from the opening book for the position, None when it isn't in the book, there is no book file or USE_BOOK is off
+'''
+def getBookMove(gs, legalMoves):
+    global openingBook
+    if not USE_BOOK:
+        return None
+    if openingBook is None:
+        if not os.path.exists(BOOK_PATH):
+            return None
+        openingBook = ChessBook.OpeningBook(BOOK_PATH)
+    return openingBook.pickMove(gs, legalMoves)
+
+'''
+Score of the position for the side to move from the endgame tablebases, None when they don't have it
+'''
+def probeTablebases(gs):
+    if not USE_TABLEBASES or gs.pieceCount > ChessTablebase.MAX_PIECES:
+        return None
+    result = tablebases.probe(gs)
+    if result is None:
+        return None
+    outcome, plies = result
+    return outcome * (TB_WIN - plies)
+
+'''
+Reply the last search expects to bestMove: the second move of the principal variation, or the best move the
+transposition table has for the position after bestMove when the variation ends at a table hit. None when neither knows one
+'''
+def getPonderMove(gs, bestMove):
+    if len(principalVariation) > 1 and principalVariation[0] is bestMove:
+        return principalVariation[1]
+    gs.makeMove(bestMove)
+    entry = tt.probe(gs.zobristKey)
+    ponderMove = None
+    if entry is not None:
+        ponderMove = next((move for move in gs.generateLegalMoves() if move.moveID == entry[3]), None)
+    gs.undoMove()
+    return ponderMove
+
 '''
 Get a random move
 '''
@@ -70,54 +252,681 @@ def getRandomMove(legalMoves, gs):
     return legalMoves[random.randint(0, len(legalMoves)-1)]
 
 '''
-Helper function for first call of recursive minmax, also better for arguments
+Raised inside the search when the time or node budget runs out
+'''
+class SearchTimeout(Exception):
+    pass
+
+'''
+Numbers of one search, for tracking the speed of the engine. Filled in by iterativeDeepening, the parallel search adds up
+the counters of its workers. times holds the seconds spent in move generation, makeMove, undoMove and evaluation when
+PROFILE_SEARCH is set and None otherwise. makeMove includes the update of the running evaluation, which evaluation
+counts as well. profile lists the functions taking the most time of a cProfile run. The workers of the parallel search
+aren't profiled, times and profile stay None for it
+'''
+class SearchStats():
+    def __init__(self):
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.seconds = 0.0
+        self.depth = 0 # Deepest finished iteration
+        self.iterationNodes = [] # Nodes searched by every finished iteration
+        self.workers = 1 # Processes the counters were added up from
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.ttCutoffs = 0
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.aspirationResearches = 0
+        self.pvsResearches = 0
+        self.times = None
+        self.profile = None
+
+    '''
+    Add the counters of getSearchCounters, of this process or of a worker of the parallel search
+    '''
+    def addCounters(self, counters):
+        for name, value in counters.items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def nps(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+    def ttHitRate(self):
+        return self.ttHits / self.ttProbes if self.ttProbes else 0.0
+
+    '''
+    Share of beta cutoffs caused by the first move searched, the closer to 1 the better the ordering
+    '''
+    def firstMoveCutoffRate(self):
+        return self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs else 0.0
+
+    '''
+    Effective branching factor, nodes of the last iteration over those of the one before
+    '''
+    def branchingFactor(self):
+        if len(self.iterationNodes) < 2 or self.iterationNodes[-2] == 0:
+            return None
+        return self.iterationNodes[-1] / self.iterationNodes[-2]
+
+    '''
+    Share of the nodes of the main search, not counting quiescence, that failed high
+    '''
+    def cutoffRate(self):
+        mainNodes = self.nodes - self.quiescenceNodes
+        return self.betaCutoffs / mainNodes if mainNodes > 0 else 0.0
+
+    def toDict(self):
+        stats = dict(vars(self))
+        stats.update(nps=self.nps(), branchingFactor=self.branchingFactor(), cutoffRate=self.cutoffRate(), ttHitRate=self.ttHitRate(),
+                     firstMoveCutoffRate=self.firstMoveCutoffRate())
+        return stats
+
+    def __str__(self):
+        lines = ['Depth {}, {} nodes ({} quiescence) in {:.2f}s, {:.0f} nodes/s'.format(self.depth, self.nodes, self.quiescenceNodes, self.seconds, self.nps()),
+                 'Transposition table hit rate {:.1%}, {} cutoffs'.format(self.ttHitRate(), self.ttCutoffs),
+                 'Re-searches: {} aspiration, {} principal variation'.format(self.aspirationResearches, self.pvsResearches),
+                 'Beta cutoffs at {:.1%} of the nodes, on the first move {:.1%} of {}'.format(self.cutoffRate(), self.firstMoveCutoffRate(), self.betaCutoffs)]
+        if self.branchingFactor() is not None:
+            lines[0] += ', branching factor {:.2f}'.format(self.branchingFactor())
+        if self.times is not None:
+            lines.append('Move generation {moveGeneration:.2f}s, makeMove {makeMove:.2f}s, undoMove {undoMove:.2f}s, evaluation {evaluation:.2f}s'.format(**self.times))
+        return '\n'.join(lines)
+
+'''
+Counters of the search running in this process, as SearchStats.addCounters takes them
+'''
+def getSearchCounters():
+    return {'nodes': nodeCount, 'quiescenceNodes': quiescenceNodes, 'ttProbes': tt.probes, 'ttHits': tt.hits, 'ttCutoffs': tt.cutoffs,
+            'betaCutoffs': betaCutoffs, 'firstMoveCutoffs': firstMoveCutoffs, 'aspirationResearches': aspirationResearches,
+            'pvsResearches': pvsResearches}
+
+'''
+GameState methods whose time is reported in SearchStats.times, as (name, key of times). The running evaluation is
+updated in getMoveScore and computeEvaluation, scoreMaterial only reads it
+'''
+TIMED_METHODS = (('generateLegalMoves', 'moveGeneration'), ('getCaptureMoves', 'moveGeneration'), ('makeMove', 'makeMove'),
+                 ('undoMove', 'undoMove'), ('getMoveScore', 'evaluation'), ('computeEvaluation', 'evaluation'))
+
+'''
+Start profiling the search as PROFILE_SEARCH says. 'timers' puts a perf_counter wrapper around every timed method of
+the searched game state only, as instance attributes that hide the class methods until stopProfiling deletes them, so
+no other GameState is slowed down or counted. 'cprofile' starts a profiler. Returns what stopProfiling needs
+'''
+def startProfiling(gs, stats):
+    if PROFILE_SEARCH == 'timers':
+        stats.times = {'moveGeneration': 0.0, 'makeMove': 0.0, 'undoMove': 0.0, 'evaluation': 0.0}
+        for name, key in TIMED_METHODS:
+            def timed(*args, method=getattr(gs, name), key=key, **kwargs):
+                start = time.perf_counter()
+                result = method(*args, **kwargs)
+                stats.times[key] += time.perf_counter() - start
+                return result
+            setattr(gs, name, timed)
+        return None
+    if PROFILE_SEARCH == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    return None
+
 '''
-def getBestMove(gs, legalMoves, returnQueue):
-    global nextMove
+Stop the profiling startProfiling started and fill in the times, and for cProfile the functions taking the most time
+'''
+def stopProfiling(gs, stats, profiling):
+    if PROFILE_SEARCH == 'timers':
+        for name, key in TIMED_METHODS:
+            delattr(gs, name)
+    elif PROFILE_SEARCH == 'cprofile':
+        profiling.disable()
+        functions = pstats.Stats(profiling).stats # (file, line, name): (primitive calls, calls, own time, total time, callers)
+        stats.times = {'moveGeneration': 0.0, 'makeMove': 0.0, 'undoMove': 0.0, 'evaluation': 0.0}
+        timed = dict(TIMED_METHODS)
+        module = type(gs).__module__
+        for (path, line, name), (primitiveCalls, calls, ownTime, totalTime, callers) in functions.items():
+            key = timed.get(name) if os.path.splitext(os.path.basename(path))[0] == module else None
+            if key is not None:
+                stats.times[key] += totalTime
+        top = sorted(functions.items(), key=lambda item: item[1][2], reverse=True)[:PROFILE_TOP]
+        stats.profile = [{'function': '{}:{}({})'.format(os.path.basename(path), line, name), 'calls': calls, 'ownTime': ownTime, 'totalTime': totalTime}
+                         for (path, line, name), (primitiveCalls, calls, ownTime, totalTime, callers) in top]
+
+'''
+Helper function for first call of recursive minmax, also better for arguments.
+Searches depth 1, 2, 3... until the time (seconds) or node budget runs out and puts the best move of every completed
+iteration on returnQueue, so the caller can stop the search at any moment and use the last move on the queue.
+Without a budget it searches up to maxDepth, DEPTH by default. Returns the best move and the SearchStats of the search
+'''
+def getBestMove(gs, legalMoves, returnQueue, timeLimit=None, nodeLimit=None, maxDepth=None):
+    global nodeCount
+    bookMove = getBookMove(gs, legalMoves)
+    if bookMove is not None:
+        nodeCount = 0
+        returnQueue.put(bookMove)
+        print('BOOK move ' + bookMove.getChessNotation())
+        return bookMove, SearchStats() # Nothing searched
+    print('BEST move according to WHITE') if not gs.whiteMove else print('BEST move according to BLACK')
+    random.shuffle(legalMoves) # Equal moves keep this order when sorted, so the AI doesn't always play the same game
+    startTime = time.perf_counter()
+
+    def reportIteration(depth, bestMove, score):
+        returnQueue.put(bestMove)
+        print('Depth {}: {} score {:.2f}, {} nodes ({} quiescence), {:.2f}s, pv {}'.format(depth, bestMove.getChessNotation() if bestMove else None,
+                                                                                        score, nodeCount, quiescenceNodes, time.perf_counter() - startTime,
+                                                                                        ' '.join(move.getChessNotation() for move in principalVariation)))
+
+    bestMove, stats = iterativeDeepening(gs, legalMoves, reportIteration, timeLimit, nodeLimit, maxDepth)
+    print(stats)
+    return bestMove, stats
+
+'''
+Iterative deepening over the given root moves, calling reportIteration(depth, bestMove, score) after every completed iteration,
+with principalVariation holding the moves the score expects. Returns the best move and the SearchStats of the search. From ASPIRATION_DEPTH on an iteration first searches a narrow
+window around the score of the one before and widens it while the score falls outside.
+With stopOnForcedMove a single root move is returned after depth 1, the parallel search turns it off because a worker's
+share of the root moves can be a single move
+'''
+def iterativeDeepening(gs, legalMoves, reportIteration, timeLimit=None, nodeLimit=None, maxDepth=None, stopOnForcedMove=True):
+    global nextMove, rootDepth, rootPly, nodeCount, quiescenceNodes, searchDeadline, searchNodeLimit, principalVariation, aspirationResearches, pvsResearches
+    tt.newSearch()
+    tt.resetCounters()
+    resetMoveOrdering()
+    gs.setEvaluation(pieceSquareScores)
+
+    searchDeadline = time.perf_counter() + timeLimit if timeLimit is not None else None
+    searchNodeLimit = nodeLimit
+    nodeCount = 0
+    quiescenceNodes = 0
+    aspirationResearches = 0
+    pvsResearches = 0
+    principalVariation = []
+    rootPly = len(gs.moveLog)
+    bestMove = None
+    score = 0
+    if maxDepth is None:
+        maxDepth = MAX_DEPTH if timeLimit is not None or nodeLimit is not None else DEPTH
+    if probeTablebases(gs) is not None:
+        maxDepth = 1 # Every move leads to a tablebase position as well, one ply ranks them exactly
+    stats = SearchStats()
+    startTime = time.perf_counter()
+    profiling = startProfiling(gs, stats)
+    try:
+        for depth in range(1, maxDepth + 1):
+            rootDepth = depth
+            window = ASPIRATION_WINDOW
+            if depth >= ASPIRATION_DEPTH and abs(score) < TB_WIN - ChessTablebase.MAX_PLIES:
+                alpha, beta = max(score - window, -CHECKMATE), min(score + window, CHECKMATE)
+            else:
+                alpha, beta = -CHECKMATE, CHECKMATE
+            try:
+                while True:
+                    nextMove = None
+                    pv = []
+                    score = findNegaMaxAlphaBetaMove(gs, legalMoves, depth, alpha, beta, 1 if gs.whiteMove else -1, pv)
+                    if score <= alpha and alpha > -CHECKMATE: # Failed low, the score is only an upper bound
+                        alpha = max(alpha - window, -CHECKMATE)
+                    elif score >= beta and beta < CHECKMATE: # Failed high, only a lower bound
+                        beta = min(beta + window, CHECKMATE)
+                    else:
+                        break
+                    window *= 2
+                    aspirationResearches += 1
+            except SearchTimeout:
+                while len(gs.moveLog) > rootPly: # Take back the moves of the unfinished iteration
+                    gs.undoMove()
+                break
+            if nextMove is not None: # None when no root move was searched, keep the move of the last iteration then
+                bestMove = nextMove
+            elif bestMove is None:
+                bestMove = legalMoves[0] # There still has to be a move
+            principalVariation = pv if pv and pv[0] is bestMove else [bestMove]
+            stats.depth = depth
+            stats.iterationNodes.append(nodeCount - sum(stats.iterationNodes))
+            reportIteration(depth, bestMove, score)
+            if abs(score) >= MATE_SCORE or (stopOnForcedMove and len(legalMoves) <= 1):
+                break # A forced mate or a forced move won't change with more depth
+    finally:
+        stopProfiling(gs, stats, profiling)
+    stats.seconds = time.perf_counter() - startTime
+    stats.addCounters(getSearchCounters())
+    return bestMove, stats
+
+'''
+Root parallel search: the root moves are dealt out to the processes of a SearchPool and each worker runs its own
+iterative deepening over its share, with its own transposition table kept from search to search. The workers share the
+best root score found so far at every depth, so a worker only has to prove its moves beat the best move of the others.
+A depth is finished once every worker finished it, its best move is the highest exact score with ties going to the move
+dealt out first, so the result doesn't depend on which worker reports first. A worker that stopped early on a mate score
+keeps counting with its last result at the deeper depths.
+Takes the same arguments and returns the same as getBestMove, workers is WORKERS when None and the node budget is split evenly between them
+'''
+def getBestMoveParallel(gs, legalMoves, returnQueue, timeLimit=None, nodeLimit=None, maxDepth=None, workers=None):
+    global nodeCount, principalVariation, searchPool
+    poolSize = workers if workers is not None else WORKERS
+    workers = max(1, min(poolSize, len(legalMoves)))
+    if workers == 1:
+        return getBestMove(gs, legalMoves, returnQueue, timeLimit, nodeLimit, maxDepth)
+    bookMove = getBookMove(gs, legalMoves)
+    if bookMove is not None:
+        nodeCount = 0
+        returnQueue.put(bookMove)
+        print('BOOK move ' + bookMove.getChessNotation())
+        return bookMove, SearchStats()
     print('BEST move according to WHITE') if not gs.whiteMove else print('BEST move according to BLACK')
-    nextMove = None
     random.shuffle(legalMoves)
-    findNegaMaxAlphaBetaMove(gs, legalMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whiteMove else -1)
-    returnQueue.put(nextMove)
+    resetMoveOrdering()
+    legalMoves = orderMoves(legalMoves, -1, 0, gs.whiteMove) # Deal the captures round robin so every worker gets some good moves
+    startTime = time.perf_counter()
+
+    if searchPool is None or searchPool.size != poolSize:
+        if searchPool is not None:
+            searchPool.close()
+        searchPool = SearchPool(poolSize)
+    searchPool.start(gs, legalMoves, workers, timeLimit, nodeLimit // workers if nodeLimit is not None else None, maxDepth)
+
+    stats = SearchStats()
+    results = [[] for _ in range(workers)] # (score, exact, move index, expected reply) of every finished depth of every worker
+    done = [False] * workers
+    workerCounters = [{'nodes': 0}] * workers # Counters of the last depth every worker finished
+    bestMove = None
+    reply = None
+    depth = 1
+    mated = False
+    while not all(done): # Every worker has to be done before the pool takes the next search
+        try:
+            worker, workerDepth, score, exact, index, workerReply, counters = searchPool.resultQueue.get(timeout=0.05)
+        except queue.Empty:
+            if stopRequested is not None and stopRequested(): # Cancelled, keep the move of the last finished depth
+                searchPool.stop()
+            continue
+        workerCounters[worker] = counters
+        nodes = sum(counters['nodes'] for counters in workerCounters)
+        if workerDepth is None:
+            done[worker] = True
+        else:
+            results[worker].append((score, exact, index, workerReply))
+        merged = mergeDepth(results, done, depth) if not mated else None
+        while merged is not None: # Report every depth that is now finished by all workers
+            score, exact, index, reply = merged
+            bestMove = legalMoves[index]
+            returnQueue.put(bestMove)
+            print('Depth {}: {} score {:.2f}, {} nodes, {:.2f}s'.format(depth, bestMove.getChessNotation(), score, nodes,
+                                                                      time.perf_counter() - startTime))
+            stats.depth = depth
+            stats.iterationNodes.append(nodes - sum(stats.iterationNodes))
+            if score >= MATE_SCORE: # Nothing beats a forced mate, stop the other workers
+                searchPool.stop()
+                mated = True
+                break
+            depth += 1
+            merged = mergeDepth(results, done, depth)
+    for counters in workerCounters:
+        stats.addCounters(counters)
+    stats.workers = workers
+    nodeCount = stats.nodes
+    principalVariation = [bestMove] if bestMove is not None else []
+    if reply is not None: # Published as a two move variation, so getPonderMove works after the parallel search too
+        gs.makeMove(bestMove)
+        principalVariation += [move for move in gs.generateLegalMoves() if move.getChessNotation() == reply]
+        gs.undoMove()
+    stats.seconds = time.perf_counter() - startTime
+    return bestMove, stats
 
 '''
-Recursive algorithm for finding best move (Nega Max with Alpha Beta Pruning)
+Best (score, exact, move index, expected reply) of depth over all workers, None while a worker still has to finish it.
+An exact score wins a tie with a bound, a worker whose moves all failed low against the shared score only has a bound
 '''
-def findNegaMaxAlphaBetaMove(gs, legalMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove
+def mergeDepth(results, done, depth):
+    merged = []
+    for worker, workerResults in enumerate(results):
+        if len(workerResults) >= depth:
+            merged.append(workerResults[depth - 1])
+        elif done[worker] and workerResults and abs(workerResults[-1][0]) >= MATE_SCORE:
+            merged.append(workerResults[-1]) # Stopped on a mate score, deeper searches wouldn't change it
+        else:
+            return None
+    return max(merged, key=lambda result: (result[0], result[1], -result[2]))
+
+'''
+Worker processes of getBestMoveParallel, started on its first call and kept for the searches after it, so no process is
+started per move and the transposition table of every worker stays warm. rootScores holds the best exact root score any
+worker found at every depth of the running search, stopEvent stops every worker at its next budget check
+'''
+class SearchPool():
+    def __init__(self, size):
+        self.size = size
+        self.rootScores = multiprocessing.RawArray('d', MAX_DEPTH + 1)
+        self.stopEvent = multiprocessing.Event()
+        self.resultQueue = multiprocessing.Queue()
+        self.connections = []
+        self.processes = []
+        for worker in range(size):
+            connection, workerConnection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=runPoolWorker, args=(workerConnection, worker, self.resultQueue, self.rootScores, self.stopEvent),
+                                              daemon=True)
+            process.start()
+            workerConnection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    '''
+    Deal the root moves out round robin to the first workers of the pool and start them searching
+    '''
+    def start(self, gs, rootMoves, workers, timeLimit, nodeLimit, maxDepth):
+        self.stopEvent.clear()
+        for depth in range(MAX_DEPTH + 1):
+            self.rootScores[depth] = -CHECKMATE
+        for worker in range(workers):
+            indices = list(range(worker, len(rootMoves), workers))
+            self.connections[worker].send((gs, [rootMoves[i].getChessNotation() for i in indices], indices, timeLimit, nodeLimit, maxDepth))
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+
+searchPool = None # SearchPool of getBestMoveParallel
+
+'''
+Main loop of a SearchPool worker, searching the jobs sent to it until it gets None
+'''
+def runPoolWorker(connection, worker, resultQueue, rootScores, stopEvent):
+    global stopRequested, PROFILE_SEARCH, ASPIRATION_DEPTH, sharedRootScores
+    stopRequested = stopEvent.is_set
+    PROFILE_SEARCH = None # The numbers of a worker don't reach the parent
+    ASPIRATION_DEPTH = MAX_DEPTH + 1 # The score of a share of the root moves says little about the next iteration
+    sharedRootScores = rootScores
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError: # The parent is gone
+            break
+        if job is None:
+            break
+        gs, notations, indices, timeLimit, nodeLimit, maxDepth = job
+        legalMoves = gs.generateLegalMoves()
+        rootMoves = [next(move for move in legalMoves if move.getChessNotation() == notation) for notation in notations]
+        searchRootMoves(gs, rootMoves, indices, worker, resultQueue, timeLimit, nodeLimit, maxDepth)
+
+'''
+Search of one worker of the pool. Puts (worker, depth, score, exact, move index, expected reply, counters) on resultQueue
+after every completed depth, the reply in coordinate notation or None and the counters of getSearchCounters, and
+(worker, None, None, None, None, None, counters) when done. exact is False when no move of the share beat the shared score
+'''
+def searchRootMoves(gs, rootMoves, indices, worker, resultQueue, timeLimit, nodeLimit, maxDepth):
+    global ownRootScores
+    ownRootScores = [None] * (MAX_DEPTH + 1)
+    def reportIteration(depth, bestMove, score):
+        position = 0 if bestMove is None else [move.moveID for move in rootMoves].index(bestMove.moveID)
+        reply = getPonderMove(gs, bestMove) if bestMove is not None else None
+        resultQueue.put((worker, depth, score, ownRootScores[depth] == score, indices[position], reply.getChessNotation() if reply else None,
+                         getSearchCounters()))
+
+    iterativeDeepening(gs, rootMoves, reportIteration, timeLimit, nodeLimit, maxDepth, stopOnForcedMove=False)
+    resultQueue.put((worker, None, None, None, None, None, getSearchCounters()))
+
+'''
+Stop the search by raising SearchTimeout once the budget is spent, or once stopRequested returns True. The first iteration always finishes, so there is a move to play
+'''
+def checkSearchLimits():
+    if rootDepth == 1:
+        return
+    if stopRequested is not None and stopRequested():
+        raise SearchTimeout()
+    if searchDeadline is not None and time.perf_counter() >= searchDeadline:
+        raise SearchTimeout()
+    if searchNodeLimit is not None and nodeCount >= searchNodeLimit:
+        raise SearchTimeout()
+
+'''
+Recursive algorithm for finding best move (Nega Max with Alpha Beta Pruning), as a principal variation search: the first move
+after ordering is searched with the full window and is expected to stay best, every other move is only tested against alpha
+with a null window and searched again with the full window when it beats alpha after all.
+The best line found inside the window is written to pv
+'''
+def findNegaMaxAlphaBetaMove(gs, legalMoves, depth, alpha, beta, turnMultiplier, pv):
+    global nextMove, nodeCount, pvsResearches
+    nodeCount += 1
+    if nodeCount % CHECK_EVERY == 0:
+        checkSearchLimits()
+    if depth != rootDepth:
+        if len(legalMoves) == 0:
+            return matedScore(gs) if gs.in_check else STALEMATE
+        if gs.halfmoveClock >= 100 or gs.isRepetition():
+            return DRAW # Repeating once inside the search is enough, the side that could avoid it chose not to
+        if gs.pieceCount <= ChessTablebase.MAX_PIECES:
+            score = probeTablebases(gs)
+            if score is not None:
+                return score
     if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
+        nodeCount -= 1 # Counted again as the first quiescence node
+        return quiescenceSearch(gs, alpha, beta, turnMultiplier)
+
+    # Transposition table. The root never returns early, it has to set nextMove
+    alphaOriginal = alpha
+    entry = tt.probe(gs.zobristKey)
+    if entry is not None:
+        ttDepth, ttScore, ttFlag, ttMoveID = entry
+        ttScore = scoreFromTable(ttScore, rootDepth - depth)
+        if ttDepth >= depth and depth != rootDepth:
+            if ttFlag == EXACT:
+                alpha = beta = ttScore
+            elif ttFlag == LOWER_BOUND:
+                alpha = max(alpha, ttScore)
+            else:
+                beta = min(beta, ttScore)
+            if alpha >= beta:
+                tt.cutoffs += 1
+                return ttScore
+    else:
+        ttMoveID = -1
+    ply = rootDepth - depth
+    legalMoves = orderMoves(legalMoves, ttMoveID, ply, gs.whiteMove)
     
     maxScore = -CHECKMATE
-    for move in legalMoves:
+    bestMoveID = -1
+    for moveNumber, move in enumerate(legalMoves):
+        if depth == rootDepth and sharedRootScores is not None and sharedRootScores[depth] > alpha:
+            alpha = sharedRootScores[depth] # Another worker has a move this good, ours only need to be proved worse
+            if alpha >= beta:
+                break
         gs.makeMove(move)
-        nextMoves = gs.getLegalMoves()
-        score = -findNegaMaxAlphaBetaMove(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier)
+        nextMoves = gs.generateLegalMoves()
+        childPV = []
+        if moveNumber == 0:
+            score = -findNegaMaxAlphaBetaMove(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier, childPV)
+        else:
+            score = -findNegaMaxAlphaBetaMove(gs, nextMoves, depth - 1, -alpha - NULL_WINDOW, -alpha, -turnMultiplier, childPV)
+            if alpha < score < beta:
+                pvsResearches += 1
+                childPV = []
+                score = -findNegaMaxAlphaBetaMove(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier, childPV)
         if score > maxScore:
             maxScore = score
-            if depth == DEPTH:
+            bestMoveID = move.moveID
+            if depth == rootDepth:
                 nextMove = move
+            if score > alpha:
+                pv[:] = [move] + childPV
+                if depth == rootDepth and sharedRootScores is not None:
+                    ownRootScores[depth] = score
+                    if score > sharedRootScores[depth]:
+                        sharedRootScores[depth] = score
         gs.undoMove()
         if maxScore > alpha: # Pruning
             alpha = maxScore
         if alpha >= beta:
+            recordCutoff(move, moveNumber, depth, ply, gs.whiteMove)
             break
+
+    if maxScore <= alphaOriginal:
+        flag = UPPER_BOUND
+    elif maxScore >= beta:
+        flag = LOWER_BOUND
+    else:
+        flag = EXACT
+    tt.store(gs.zobristKey, depth, scoreToTable(maxScore, ply), flag, bestMoveID)
     return maxScore
 
 '''
-A positive score is good for white, a negative score is good for black
+Score of the side to move when it is checkmated: lost, less the plies from the root so the quickest mate scores highest
 '''
-def scoreBoard(gs):
-    if gs.checkmate:
-        if gs.whiteMove:
-            return -CHECKMATE # Black wins
-        else:
-            return CHECKMATE # White wins
-    elif gs.stalemate:
-        return STALEMATE # No one wins
-    elif gs.draw:
-        return DRAW
+def matedScore(gs):
+    return -(CHECKMATE - (len(gs.moveLog) - rootPly))
+
+'''
+The transposition table keeps mate scores counted from the stored position rather than from the root, so they stay
+right when the position comes up again at another ply or in a later search
+'''
+def scoreToTable(score, ply):
+    if score >= MATE_SCORE:
+        return score + ply
+    if score <= -MATE_SCORE:
+        return score - ply
+    return score
 
+def scoreFromTable(score, ply):
+    if score >= MATE_SCORE:
+        return score - ply
+    if score <= -MATE_SCORE:
+        return score + ply
+    return score
+
+'''
+Search captures and promotions only until the position is quiet, so the static score isn't taken in the middle of an exchange.
+The side to move may stand pat on the static score, except in check where every evasion is searched
+'''
+def quiescenceSearch(gs, alpha, beta, turnMultiplier):
+    global nodeCount, quiescenceNodes
+    nodeCount += 1
+    quiescenceNodes += 1
+    if nodeCount % CHECK_EVERY == 0:
+        checkSearchLimits()
+
+    inCheck = gs.inCheck() # Attack test only, so just one of the generators runs
+    if inCheck:
+        moves = gs.generateLegalMoves()
+        if len(moves) == 0:
+            return matedScore(gs)
+        maxScore = standPat = -CHECKMATE
+    else:
+        moves = gs.getCaptureMoves()
+        maxScore = standPat = turnMultiplier * scoreMaterial(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+
+    for move in orderCaptures(moves):
+        if not inCheck:
+            if move.isPromotion and move.promotionPiece != 'Q':
+                continue # Underpromotions are left to the main search
+            # Delta pruning, even winning the captured piece with margin to spare wouldn't raise alpha
+            gain = pieceValues[move.pieceCaptured[1]] if move.isCapture else 0
+            if move.isPromotion:
+                gain += pieceValues['Q'] - pieceValues['P']
+            if standPat + gain + DELTA_MARGIN <= alpha:
+                maxScore = max(maxScore, standPat + gain + DELTA_MARGIN) # The capture might have scored this much, a fail low can't claim less
+                continue
+        gs.makeMove(move)
+        score = -quiescenceSearch(gs, -beta, -alpha, -turnMultiplier)
+        gs.undoMove()
+        if score > maxScore:
+            maxScore = score
+        if maxScore > alpha:
+            alpha = maxScore
+        if alpha >= beta:
+            break
+    return maxScore
+
+'''
+Sort captures by most valuable victim, then least valuable attacker (MVV-LVA)
+'''
+def orderCaptures(moves):
+    return sorted(moves, key=lambda move: 10 * pieceValues[move.pieceCaptured[1]] - pieceValues[move.pieceMoved[1]]
+                  if move.isCapture else 0, reverse=True)
+
+'''
+Forget the killers of the last search and age its history, called at the start of every search
+'''
+def resetMoveOrdering():
+    global killerMoves, betaCutoffs, firstMoveCutoffs
+    killerMoves = [[-1, -1] for ply in range(MAX_DEPTH + 1)] # moveIDs of the last two quiet moves that cut off at each ply
+    for scores in historyScores:
+        for i in range(len(scores)):
+            scores[i] //= 2
+    betaCutoffs = 0
+    firstMoveCutoffs = 0
+
+historyScores = ([0] * 4096, [0] * 4096) # White, black. Indexed by start square * 64 + end square
+resetMoveOrdering()
+
+'''
+Sort moves so the likely best come first: the transposition table move, captures by most valuable victim and least valuable
+attacker (MVV-LVA), killer moves of this ply, then quiet moves by how often they caused a cutoff (history heuristic)
+'''
+def orderMoves(legalMoves, ttMoveID, ply, whiteMove):
+    killers = killerMoves[ply]
+    history = historyScores[0 if whiteMove else 1]
+    def moveScore(move):
+        if move.moveID == ttMoveID:
+            return TT_MOVE_SCORE
+        if move.isCapture or move.isPromotion:
+            score = CAPTURE_SCORE - pieceValues[move.pieceMoved[1]]
+            if move.isCapture:
+                score += 10 * pieceValues[move.pieceCaptured[1]]
+            if move.isPromotion:
+                score += 10 * pieceValues[move.promotionPiece]
+            return score
+        if move.moveID == killers[0]:
+            return KILLER_SCORES[0]
+        if move.moveID == killers[1]:
+            return KILLER_SCORES[1]
+        return history[(move.startRow * 8 + move.startCol) * 64 + move.endRow * 8 + move.endCol]
+    return sorted(legalMoves, key=moveScore, reverse=True)
+
+'''
+Remember a move that caused a beta cutoff. Quiet moves become killers of the ply and gain history, deeper cutoffs gain more
+'''
+def recordCutoff(move, moveNumber, depth, ply, whiteMove):
+    global betaCutoffs, firstMoveCutoffs
+    betaCutoffs += 1
+    if moveNumber == 0:
+        firstMoveCutoffs += 1
+    if move.isCapture or move.isPromotion:
+        return # Already ordered by MVV-LVA
+    killers = killerMoves[ply]
+    if killers[0] != move.moveID:
+        killers[1] = killers[0]
+        killers[0] = move.moveID
+    history = historyScores[0 if whiteMove else 1]
+    i = (move.startRow * 8 + move.startCol) * 64 + move.endRow * 8 + move.endCol
+    history[i] += depth * depth
+    if history[i] >= HISTORY_MAX:
+        for j in range(len(history)):
+            history[j] //= 2
+
+'''
+Material and piece position score of the board, positive is good for white. Read from the running score GameState keeps
+'''
+def scoreMaterial(gs):
+    if gs.squareScores is not pieceSquareScores:
+        gs.setEvaluation(pieceSquareScores)
+    if DEBUG_EVAL:
+        fullScore = computeMaterial(gs)
+        if abs(gs.evalScore - fullScore) > 1e-6:
+            raise RuntimeError('Running evaluation {} differs from full rescan {} after {}'.format(
+                gs.evalScore, fullScore, ' '.join(move.getChessNotation() for move in gs.moveLog)))
+    return gs.evalScore
+
+'''
+Material and piece position score by scanning the whole board
+'''
+def computeMaterial(gs):
     score = 0
     for row in range(len(gs.board)):
         for col in range(len(gs.board[row])):
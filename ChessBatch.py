@@ -0,0 +1,162 @@
+# Headless batch runs of ChessAI: self-play games written to a PGN file, or the analysis of every position of an EPD file
+# written as JSON lines. Games and positions are spread over a process pool and written as soon as each one finishes
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import random
+import time
+import ChessEngine, ChessAI
+from ChessPerft import START_FEN
+
+MAX_GAME_PLIES = 400 # A game still going after this is adjudicated a draw
+
+'''
+Search the position of gs with ChessAI and return (move, score for the side to move, depth, nodes, seconds).
+The search output is swallowed, a batch run only writes its results
+'''
+def searchPosition(gs, legalMoves, timeLimit, nodeLimit, maxDepth):
+    iterations = []
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        move, stats = ChessAI.iterativeDeepening(gs, legalMoves, lambda depth, bestMove, score: iterations.append((depth, score)),
+                                                 timeLimit, nodeLimit, maxDepth)
+    depth, score = iterations[-1] if iterations else (0, 0)
+    return move, score, depth, stats.nodes, time.perf_counter() - start
+
+'''
+Play one game of ChessAI against itself. Runs in a pool process, returns the game as a PGN string and its result
+'''
+def playGame(task):
+    gameNumber, fen, timeLimit, nodeLimit, maxDepth, seed = task
+    random.seed(seed) # Equal moves are tried in a shuffled order, so every game is different but can be replayed from its seed
+    gs = ChessEngine.GameState.fromFEN(fen, trackStatus=False)
+    moveTexts = []
+    termination = 'normal'
+    status = None
+    while True:
+        legalMoves = gs.generateLegalMoves()
+        status = gs.gameStatus(legalMoves)
+        if status is not None:
+            break
+        if len(gs.moveLog) >= MAX_GAME_PLIES:
+            termination = 'adjudication'
+            break
+        random.shuffle(legalMoves)
+        move, score, depth, nodes, seconds = searchPosition(gs, legalMoves, timeLimit, nodeLimit, maxDepth)
+        whiteScore = (score if gs.whiteMove else -score) + 0.0 # Adding 0.0 turns -0.0 into 0.0
+        moveNumber = ''
+        if gs.whiteMove or not moveTexts:
+            moveNumber = gs.toFEN().split()[5] + ('. ' if gs.whiteMove else '... ')
+        moveTexts.append('{}{} {{{:+.2f}/{} {} nodes {:.2f}s}}'.format(moveNumber, gs.getSAN(move, legalMoves), whiteScore, depth, nodes, seconds))
+        gs.makeMove(move)
+
+    if status == 'checkmate':
+        result = '0-1' if gs.whiteMove else '1-0'
+    else:
+        result = '1/2-1/2'
+    headers = [('Event', 'ChessAI self-play'), ('Date', datetime.date.today().strftime('%Y.%m.%d')), ('Round', str(gameNumber)),
+               ('White', 'ChessAI'), ('Black', 'ChessAI'), ('Result', result), ('Termination', termination)]
+    if fen != START_FEN:
+        headers += [('SetUp', '1'), ('FEN', fen)]
+    pgn = ''.join('[{} "{}"]\n'.format(name, value) for name, value in headers) + '\n'
+    pgn += wrapText(' '.join(moveTexts + [result])) + '\n\n'
+    return gameNumber, result, pgn
+
+'''
+Break PGN move text into lines of at most 80 characters
+'''
+def wrapText(text, width=80):
+    lines = []
+    line = ''
+    for word in text.split(' '):
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = line + ' ' + word if line else word
+    lines.append(line)
+    return '\n'.join(lines)
+
+'''
+Analyse one EPD position. Runs in a pool process, returns its result as a dict
+'''
+def analysePosition(task):
+    fen, operations, timeLimit, nodeLimit, maxDepth = task
+    gs = ChessEngine.GameState.fromFEN(fen, trackStatus=False)
+    legalMoves = gs.generateLegalMoves()
+    result = {'fen': fen}
+    if 'id' in operations:
+        result['id'] = ' '.join(operations['id'])
+    if not legalMoves:
+        result['status'] = gs.gameStatus(legalMoves)
+        return result
+    move, score, depth, nodes, seconds = searchPosition(gs, legalMoves, timeLimit, nodeLimit, maxDepth)
+    san = gs.getSAN(move, legalMoves)
+    result.update({'move': move.getChessNotation(), 'san': san, 'score': score, 'depth': depth, 'nodes': nodes, 'seconds': round(seconds, 3)})
+    if 'bm' in operations: # Best move test suites, the check and mate marks are optional there
+        result['solved'] = san.rstrip('+#') in [bestMove.rstrip('+#') for bestMove in operations['bm']]
+    return result
+
+'''
+Play games self-play games over processes processes and write them to outPath as they finish. Games start from the
+positions of openingsPath (EPD) in turn when given, otherwise from the starting position
+'''
+def runSelfPlay(games, outPath, timeLimit, nodeLimit, maxDepth, processes, openingsPath=None, seed=0):
+    openings = [fen for fen, _ in ChessEngine.readEPD(openingsPath)] if openingsPath else [START_FEN]
+    tasks = [(game + 1, openings[game % len(openings)], timeLimit, nodeLimit, maxDepth, seed + game) for game in range(games)]
+    scores = {'1-0': 0, '0-1': 0, '1/2-1/2': 0}
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool, open(outPath, 'w') as outFile:
+        for gameNumber, result, pgn in pool.imap_unordered(playGame, tasks):
+            outFile.write(pgn)
+            outFile.flush()
+            scores[result] += 1
+            print('Game {} {}  (+{} ={} -{} for white, {:.0f}s)'.format(gameNumber, result, scores['1-0'], scores['1/2-1/2'], scores['0-1'],
+                                                                     time.perf_counter() - start))
+    return scores
+
+'''
+Analyse every position of the EPD file inPath over processes processes and write one JSON line per position to outPath,
+in file order. The positions are read lazily
+'''
+def runAnalysis(inPath, outPath, timeLimit, nodeLimit, maxDepth, processes):
+    tasks = ((fen, operations, timeLimit, nodeLimit, maxDepth) for fen, operations in ChessEngine.readEPD(inPath))
+    positions = 0
+    solved = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool, open(outPath, 'w') as outFile:
+        for result in pool.imap(analysePosition, tasks):
+            outFile.write(json.dumps(result) + '\n')
+            outFile.flush()
+            positions += 1
+            solved += result.get('solved', False)
+    print('{} positions analysed in {:.0f}s, {} best moves found'.format(positions, time.perf_counter() - start, solved))
+
+def main():
+    parser = argparse.ArgumentParser(description='Run ChessAI without a display: self-play games or the analysis of an EPD file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    selfPlay = subparsers.add_parser('selfplay', help='play games of the AI against itself and write them as PGN')
+    selfPlay.add_argument('--games', type=int, default=10)
+    selfPlay.add_argument('--out', default='selfplay.pgn')
+    selfPlay.add_argument('--openings', help='EPD file of start positions, used in turn')
+    selfPlay.add_argument('--seed', type=int, default=0, help='seed of the first game, the next games count up from it')
+    analyse = subparsers.add_parser('analyse', help='search every position of an EPD file and write the results as JSON lines')
+    analyse.add_argument('epd')
+    analyse.add_argument('--out', default='analysis.jsonl')
+    for subparser in (selfPlay, analyse):
+        subparser.add_argument('--time', type=float, help='seconds per move')
+        subparser.add_argument('--nodes', type=int, help='nodes per move')
+        subparser.add_argument('--depth', type=int, help='depth per move, the default when no time or nodes are given is ChessAI.DEPTH')
+        subparser.add_argument('--processes', type=int, default=ChessAI.WORKERS, help='games or positions searched at once')
+    args = parser.parse_args()
+
+    if args.command == 'selfplay':
+        runSelfPlay(args.games, args.out, args.time, args.nodes, args.depth, args.processes, args.openings, args.seed)
+    else:
+        runAnalysis(args.epd, args.out, args.time, args.nodes, args.depth, args.processes)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Search benchmark: fixed depth searches of the perft reference positions, single process against the parallel root search.
+# With --report the numbers of every search are written as JSON, to compare releases and machines
+import argparse
+import json
+import os
+import platform
+import queue
+import random
+import time
+import ChessEngine, ChessAI
+from ChessPerft import PERFT_POSITIONS
+
+BENCH_POSITIONS = ('startpos', 'kiwipete', 'position3', 'position4', 'position5', 'position6', 'castle rights')
+
+'''
+Search one position to depth and return the seconds taken, the nodes searched, the move found and the SearchStats
+'''
+def runSearch(fen, depth, workers):
+    gs = ChessEngine.GameState.fromFEN(fen)
+    random.seed(0) # Same root move order for every run
+    ChessAI.tt.clear() # Forked workers would start from the entries of the run before
+    start = time.perf_counter()
+    move, stats = ChessAI.getBestMoveParallel(gs, gs.generateLegalMoves(), queue.Queue(), maxDepth=depth, workers=workers)
+    return time.perf_counter() - start, stats.nodes, move, stats
+
+'''
+Search every benchmark position with one process and with workers processes and print the speedup. With reportPath
+the statistics of every search are written there as JSON. profile is a ChessAI.PROFILE_SEARCH mode: profiling slows
+the search down, so the timed searches run without it and every position is searched again with one process under it
+'''
+def runBenchmark(depth, workers, reportPath=None, profile=None):
+    ChessAI.USE_BOOK = False # Time the search, not the book lookup
+    ChessAI.PROFILE_SEARCH = None
+    results = []
+    for name, fen, _ in PERFT_POSITIONS:
+        if name in BENCH_POSITIONS:
+            single = runSearch(fen, depth, 1)
+            parallel = runSearch(fen, depth, workers)
+            results.append((name, single, parallel))
+    profiled = {}
+    if profile is not None:
+        ChessAI.PROFILE_SEARCH = profile
+        for name, fen, _ in PERFT_POSITIONS:
+            if name in BENCH_POSITIONS:
+                profiled[name] = runSearch(fen, depth, 1)[3]
+        ChessAI.PROFILE_SEARCH = None
+    print()
+    print('{:<16} {:>9} {:>9} {:>10} {:>10} {:>8}  {}'.format('position', '1 worker', str(workers) + ' workers', 'nodes', 'nodes', 'speedup', 'moves'))
+    for name, (singleSeconds, singleNodes, singleMove, _), (parallelSeconds, parallelNodes, parallelMove, _) in results:
+        print('{:<16} {:>8.2f}s {:>8.2f}s {:>10} {:>10} {:>7.2f}x  {} {}'.format(name, singleSeconds, parallelSeconds, singleNodes, parallelNodes,
+                                                                             singleSeconds / max(parallelSeconds, 1e-9),
+                                                                             singleMove.getChessNotation(), parallelMove.getChessNotation()))
+    singleTotal = sum(single[0] for _, single, _ in results)
+    parallelTotal = sum(parallel[0] for _, _, parallel in results)
+    print('Total: {:.2f}s with 1 worker, {:.2f}s with {} workers, speedup {:.2f}x'.format(singleTotal, parallelTotal, workers,
+                                                                                      singleTotal / max(parallelTotal, 1e-9)))
+    if reportPath is not None:
+        writeReport(reportPath, depth, workers, profile, results, profiled)
+
+'''
+Write the benchmark results as JSON, with the machine they were taken on. profiled holds the SearchStats of the
+profiling pass by position name
+'''
+def writeReport(path, depth, workers, profile, results, profiled):
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'platform': platform.platform(),
+              'processor': platform.processor(), 'cpus': os.cpu_count(), 'depth': depth, 'workers': workers, 'profile': profile,
+              'notes': 'single and parallel are timed without profiling, parallel counters are summed over its workers. '
+                       'profiled is a separate one process search under the profile mode, null without one',
+              'positions': []}
+    for name, single, parallel in results:
+        report['positions'].append({'name': name, 'move': single[2].getChessNotation(), 'single': single[3].toDict(),
+                                    'parallel': parallel[3].toDict(), 'profiled': profiled[name].toDict() if name in profiled else None})
+    with open(path, 'w') as reportFile:
+        json.dump(report, reportFile, indent=2)
+    print('Report written to ' + path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time fixed depth searches with one process and with the parallel root search')
+    parser.add_argument('--depth', type=int, default=4, help='plies to search every position')
+    parser.add_argument('--workers', type=int, default=ChessAI.WORKERS, help='processes for the parallel search')
+    parser.add_argument('--report', help='write the statistics of every search to this JSON file')
+    parser.add_argument('--profile', choices=('timers', 'cprofile'), help='search every position once more to time move generation, make/undo and evaluation')
+    args = parser.parse_args()
+    runBenchmark(args.depth, args.workers, args.report, args.profile)
+
+if __name__ == "__main__":
+    main()
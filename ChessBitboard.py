@@ -0,0 +1,110 @@
+# Bitboard tables and attack lookups for the GameState bitboard backend
+# A square is indexed as row * 8 + col, the same layout as GameState.board, so square 0 is a8 and square 63 is h1
+
+PIECES = ('wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK')
+PIECE_INDEX = {piece : i for i, piece in enumerate(PIECES)} # Index of a piece's bitboard in GameState.bitboards
+FULL = (1 << 64) - 1 # Every square set
+
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+'''
+Squares reached by a single step from every square
+'''
+def buildStepAttacks(steps):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        attacks = 0
+        for dr, dc in steps:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                attacks |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(attacks)
+    return tuple(table)
+
+'''
+Squares reached by sliding from sq until the first occupied square (included) or the border
+'''
+def slidingAttacks(sq, occupied, directions):
+    attacks = 0
+    r, c = divmod(sq, 8)
+    for dr, dc in directions:
+        endRow = r + dr
+        endCol = c + dc
+        while 0 <= endRow < 8 and 0 <= endCol < 8:
+            bit = 1 << (endRow * 8 + endCol)
+            attacks |= bit
+            if occupied & bit: # Blocked, the blocker itself is still attacked
+                break
+            endRow += dr
+            endCol += dc
+    return attacks
+
+'''
+Squares whose occupancy can change a slider's attacks from sq. The last square of every ray never blocks anything
+'''
+def relevantMask(sq, directions):
+    mask = 0
+    r, c = divmod(sq, 8)
+    for dr, dc in directions:
+        endRow = r + dr
+        endCol = c + dc
+        while 0 <= endRow + dr < 8 and 0 <= endCol + dc < 8:
+            mask |= 1 << (endRow * 8 + endCol)
+            endRow += dr
+            endCol += dc
+    return mask
+
+'''
+Squares strictly between a and b when they share a rank, file or diagonal, otherwise empty
+'''
+def buildBetween():
+    table = [0] * 4096
+    for a in range(64):
+        r, c = divmod(a, 8)
+        for dr, dc in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            between = 0
+            endRow = r + dr
+            endCol = c + dc
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                b = endRow * 8 + endCol
+                table[a * 64 + b] = between
+                between |= 1 << b
+                endRow += dr
+                endCol += dc
+    return tuple(table)
+
+KNIGHT_ATTACKS = buildStepAttacks(KNIGHT_STEPS)
+KING_ATTACKS = buildStepAttacks(KING_STEPS)
+PAWN_ATTACKS = (buildStepAttacks(((-1, -1), (-1, 1))), # Squares attacked by a white pawn standing on sq
+                buildStepAttacks(((1, -1), (1, 1)))) # Squares attacked by a black pawn standing on sq
+
+ROOK_RAYS = tuple(slidingAttacks(sq, 0, ROOK_DIRECTIONS) for sq in range(64)) # Rook attacks on an empty board
+BISHOP_RAYS = tuple(slidingAttacks(sq, 0, BISHOP_DIRECTIONS) for sq in range(64))
+ROOK_MASKS = tuple(relevantMask(sq, ROOK_DIRECTIONS) for sq in range(64))
+BISHOP_MASKS = tuple(relevantMask(sq, BISHOP_DIRECTIONS) for sq in range(64))
+BETWEEN = buildBetween() # Indexed by a * 64 + b
+
+# Slider attack lookups keyed by the relevant occupancy of a square
+# Filled on first use, the tables never hold more than 102400 rook and 5248 bishop entries
+ROOK_TABLE = tuple({} for sq in range(64))
+BISHOP_TABLE = tuple({} for sq in range(64))
+
+def rookAttacks(sq, occupied):
+    key = occupied & ROOK_MASKS[sq]
+    attacks = ROOK_TABLE[sq].get(key)
+    if attacks is None:
+        attacks = ROOK_TABLE[sq][key] = slidingAttacks(sq, key, ROOK_DIRECTIONS)
+    return attacks
+
+def bishopAttacks(sq, occupied):
+    key = occupied & BISHOP_MASKS[sq]
+    attacks = BISHOP_TABLE[sq].get(key)
+    if attacks is None:
+        attacks = BISHOP_TABLE[sq][key] = slidingAttacks(sq, key, BISHOP_DIRECTIONS)
+    return attacks
+
+def queenAttacks(sq, occupied):
+    return rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
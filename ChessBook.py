@@ -0,0 +1,154 @@
+# Opening book: a binary file of 16 byte entries sorted by position key, read through a memory map and binary searched.
+# The layout follows Polyglot (key, move, weight, learn, big-endian), but the keys are GameState.zobristKey and the move
+# is packed as start square | end square << 6 | promotion << 12 with squares as row * 8 + col, so Polyglot books can't be read.
+# Build one from PGN games with: python ChessBook.py openings.pgn book.bin
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+import ChessEngine
+
+ENTRY = struct.Struct('>QHHI') # Key, move, weight, learn (unused)
+BOOK_PLIES = 20 # Plies of every game the builder puts in the book
+
+'''
+Read only book file, opened once and shared by every lookup
+'''
+class OpeningBook():
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.path.getsize(path)
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b'' # An empty file can't be mapped
+        self.entries = size // ENTRY.size
+
+    '''
+    (move code, weight) of every book move of the position with this key
+    '''
+    def findMoves(self, key):
+        low = 0
+        high = self.entries
+        while low < high: # First entry with a key not below key
+            middle = (low + high) // 2
+            if struct.unpack_from('>Q', self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        while low < self.entries:
+            entryKey, moveCode, weight, _ = ENTRY.unpack_from(self.data, low * ENTRY.size)
+            if entryKey != key:
+                break
+            moves.append((moveCode, weight))
+            low += 1
+        return moves
+
+    '''
+    Pick one of the book moves of the position at random, more often the higher its weight. None when the position isn't in the book
+    '''
+    def pickMove(self, gs, legalMoves):
+        candidates = []
+        weights = []
+        for moveCode, weight in self.findMoves(gs.zobristKey):
+            for move in legalMoves:
+                if encodeMove(move) == moveCode:
+                    candidates.append(move)
+                    weights.append(weight)
+                    break
+        if not candidates or sum(weights) == 0:
+            return None
+        return random.choices(candidates, weights)[0]
+
+    def close(self):
+        if self.entries:
+            self.data.close()
+        self.file.close()
+
+def encodeMove(move):
+    promotion = ChessEngine.Move.promotionPieces.index(move.promotionPiece) + 1 if move.isPromotion else 0
+    return (move.startRow * 8 + move.startCol) | (move.endRow * 8 + move.endCol) << 6 | promotion << 12
+
+'''
+Read the games of a PGN file one at a time, yielding (headers, SAN moves, result). Comments, variations, move numbers
+and annotations are skipped
+'''
+def readPGN(path):
+    headers = {}
+    moveText = []
+    with open(path) as pgnFile:
+        for line in pgnFile:
+            line = line.strip()
+            if line.startswith('['):
+                if moveText: # Headers after move text start the next game
+                    yield parseGame(headers, ' '.join(moveText))
+                    headers = {}
+                    moveText = []
+                match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
+                if match:
+                    headers[match.group(1)] = match.group(2)
+            elif line:
+                moveText.append(line)
+    if moveText:
+        yield parseGame(headers, ' '.join(moveText))
+
+def parseGame(headers, moveText):
+    moveText = re.sub(r'\{[^}]*\}|;[^\n]*', ' ', moveText) # Comments
+    while '(' in moveText: # Variations, innermost first
+        moveText = re.sub(r'\([^()]*\)', ' ', moveText)
+    moves = []
+    result = headers.get('Result', '*')
+    for word in moveText.split():
+        word = re.sub(r'^\d+\.+', '', word) # Move number stuck to the move, 1.e4
+        if not word or word.startswith('$'):
+            continue
+        if word in ('1-0', '0-1', '1/2-1/2', '*'):
+            result = word
+            continue
+        moves.append(word.rstrip('!?'))
+    return headers, moves, result
+
+'''
+Build a book from PGN files. Every move played in the first plies of a game is scored for the side that made it:
+2 for a win, 1 for a draw, 0 for a loss, like the Polyglot builder does, and moves that end with no score are left out
+'''
+def buildBook(pgnPaths, outPath, plies=BOOK_PLIES):
+    weights = {}
+    games = 0
+    for path in pgnPaths:
+        for headers, sanMoves, result in readPGN(path):
+            gs = ChessEngine.GameState.fromFEN(headers['FEN'], trackStatus=False) if 'FEN' in headers else ChessEngine.GameState(trackStatus=False)
+            games += 1
+            for san in sanMoves[:plies]:
+                legalMoves = gs.generateLegalMoves()
+                move = next((move for move in legalMoves if gs.getSAN(move, legalMoves).rstrip('+#') == san.rstrip('+#')), None)
+                if move is None:
+                    print('Game {}: {} is not a legal move after {}'.format(games, san, ' '.join(sanMoves[:len(gs.moveLog)])))
+                    break
+                if result == '1/2-1/2':
+                    score = 1
+                elif result in ('1-0', '0-1'):
+                    score = 2 if (result == '1-0') == gs.whiteMove else 0
+                else:
+                    score = 1 # Unknown result, still worth playing
+                entry = (gs.zobristKey, encodeMove(move))
+                weights[entry] = weights.get(entry, 0) + score
+                gs.makeMove(move)
+
+    entries = sorted((key, moveCode, weight) for (key, moveCode), weight in weights.items() if weight > 0)
+    scale = max([weight for _, _, weight in entries] + [0]) / 65535
+    with open(outPath, 'wb') as bookFile:
+        for key, moveCode, weight in entries:
+            bookFile.write(ENTRY.pack(key, moveCode, max(int(weight / scale), 1) if scale > 1 else weight, 0))
+    print('{} games, {} book entries written to {}'.format(games, len(entries), outPath))
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an opening book from PGN games')
+    parser.add_argument('pgn', nargs='+', help='PGN files to read')
+    parser.add_argument('book', help='book file to write')
+    parser.add_argument('--plies', type=int, default=BOOK_PLIES, help='plies of every game to put in the book')
+    args = parser.parse_args()
+    buildBook(args.pgn, args.book, args.plies)
+
+if __name__ == "__main__":
+    main()
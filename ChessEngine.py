@@ -1,12 +1,47 @@
 # Game info, valid moves, moves log
+import random
+from ChessBitboard import (PIECES, PIECE_INDEX, FULL, BETWEEN, KNIGHT_STEPS, ROOK_DIRECTIONS, BISHOP_DIRECTIONS,
+                           KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, ROOK_RAYS, BISHOP_RAYS, rookAttacks, bishopAttacks)
+
+# Zobrist keys, from a fixed seed so every process hashes a position to the same key
+zobristRandom = random.Random(20240601)
+ZOBRIST_PIECES = {piece : [zobristRandom.getrandbits(64) for sq in range(64)] for piece in PIECES} # Indexed by row * 8 + col
+ZOBRIST_BLACK_MOVE = zobristRandom.getrandbits(64)
+ZOBRIST_CASTLE = [zobristRandom.getrandbits(64) for rights in range(16)] # Indexed by the packed castle rights
+ZOBRIST_EN_PASSANT = [zobristRandom.getrandbits(64) for col in range(8)]
+
+# Castle rights, packed into the 4 bits of GameState.castleRights
+WKS = 1
+BKS = 2
+WQS = 4
+BQS = 8
+ALL_CASTLE_RIGHTS = WKS | BKS | WQS | BQS
+# Rights kept by a move from or to each square: a king or rook leaving its square, or a rook taken on it, loses them
+CASTLE_RIGHTS_MASK = [ALL_CASTLE_RIGHTS] * 64
+CASTLE_RIGHTS_MASK[0] = ALL_CASTLE_RIGHTS & ~BQS # a8
+CASTLE_RIGHTS_MASK[4] = ALL_CASTLE_RIGHTS & ~(BKS | BQS) # e8
+CASTLE_RIGHTS_MASK[7] = ALL_CASTLE_RIGHTS & ~BKS # h8
+CASTLE_RIGHTS_MASK[56] = ALL_CASTLE_RIGHTS & ~WQS # a1
+CASTLE_RIGHTS_MASK[60] = ALL_CASTLE_RIGHTS & ~(WKS | WQS) # e1
+CASTLE_RIGHTS_MASK[63] = ALL_CASTLE_RIGHTS & ~WKS # h1
+
+NO_SQUARE = 64
+SQUARES = tuple(divmod(sq, 8) for sq in range(64)) + ((),) # (row, col) of every square, NO_SQUARE gives () like enPassantPossible
+
+# Undo stack. Every ply has a record of UNDO_RECORD slots, the state packed into one int (castle rights, en passant square
+# and half move clock), the hash and the evaluation of the position before the move. The stack doubles when it runs out
+UNDO_RECORD = 3
+UNDO_STACK_SIZE = 256 # Plies preallocated
 
 class GameState():
-    def __init__(self):
+    def __init__(self, useBitboards=True, trackStatus=True):
         """
         Board is 8x8 2D list of strings
         First character represents color
         Second character represents piece
         Double dash represents empty space
+        With useBitboards the position is also kept as one 64-bit bitboard per piece, which is what legal moves are generated from.
+        The board list is always kept up to date for drawing
         """
         self.board = [
                     ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
@@ -25,27 +60,248 @@ class GameState():
         self.check = False
         self.checks = []
         self.pins = []
+        self.trackStatus = trackStatus # getLegalMoves sets the three flags below, generateLegalMoves never does
         self.checkmate = False
         self.draw = False
         self.stalemate = False
         self.enPassantPossible = () # Coordinates or square where en passant is applied
-        self.enPassantPossibleLog = [self.enPassantPossible]
         self.promotePiece = 'Q' # Set as default for AI
-        self.moveCountWhite = 0
-        self.moveCountBlack = 0
+        self.halfmoveClock = 0 # Plies since the last capture or pawn move, for the 50 move rule and the repetition scan
+        self.startFullmove = 1 # Full move number of the first position, moveLog counts from there
+        self.pieceCount = 32 # Pieces on the board, kings included
         
         # Castling
-        self.currentCastleRights = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks,
-                                               self.currentCastleRights.wqs, self.currentCastleRights.bqs)]
+        self.castleRights = ALL_CASTLE_RIGHTS
+
+        # What undoMove needs to restore, one record per ply of moveLog
+        self.undoStack = [0] * (UNDO_STACK_SIZE * UNDO_RECORD)
         
         self.moveFunctions = {'P' : self.getPawnMoves, 'R' : self.getRookMoves, 'N' : self.getKnightMoves,
                                 'B' : self.getBishopMoves, 'Q' : self.getQueenMoves, 'K' : self.getKingMoves}
 
+        # Bitboards
+        self.useBitboards = useBitboards
+        if self.useBitboards:
+            self.loadBitboards()
+
+        # Zobrist hash of the position, updated by makeMove and restored from the undo stack by undoMove.
+        # The undo stack holds the hash of every earlier position of the game, so it doubles as the repetition history
+        self.zobristKey = self.computeZobristKey()
+
+        # Running evaluation, off until setEvaluation gives the scores to keep
+        self.squareScores = None
+        self.evalScore = 0
+        self.evalPly = 0 # Undo records from this ply on hold a running score
+
+    '''
+    Create a game state from a FEN string, e.g. "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+    '''
+    @classmethod
+    def fromFEN(cls, fen, useBitboards=True, trackStatus=True):
+        fields = fen.split()
+        board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(['--'] * int(char)) # Run of empty squares
+                else:
+                    row.append(('w' if char.isupper() else 'b') + char.upper())
+            board.append(row)
+
+        whiteMove = len(fields) < 2 or fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        castleRights = (('K' in castling) * WKS | ('k' in castling) * BKS | ('Q' in castling) * WQS | ('q' in castling) * BQS)
+        enPassantPossible = ()
+        if len(fields) > 3 and fields[3] != '-':
+            enPassantPossible = (Move.rankToRow[fields[3][1]], Move.fileToCol[fields[3][0]])
+        gs = cls.fromBoard(board, whiteMove, castleRights, enPassantPossible, useBitboards, trackStatus)
+        if len(fields) > 4: # The clocks are often left out, EPD has none
+            gs.halfmoveClock = int(fields[4])
+        if len(fields) > 5:
+            gs.startFullmove = int(fields[5])
+        return gs
+
+    '''
+    Create a game state from a board laid out like self.board, with no castling rights unless castleRights gives them
+    '''
+    @classmethod
+    def fromBoard(cls, board, whiteMove=True, castleRights=0, enPassantPossible=(), useBitboards=True, trackStatus=True):
+        gs = cls(useBitboards, trackStatus)
+        gs.board = [list(row) for row in board]
+        for r, row in enumerate(gs.board):
+            for c, piece in enumerate(row):
+                if piece == 'wK':
+                    gs.whiteKingLoc = (r, c)
+                elif piece == 'bK':
+                    gs.blackKingLoc = (r, c)
+        gs.pieceCount = sum(piece != '--' for row in gs.board for piece in row)
+        gs.whiteMove = whiteMove
+        gs.castleRights = castleRights
+        gs.enPassantPossible = enPassantPossible
+
+        if gs.useBitboards:
+            gs.loadBitboards()
+        gs.zobristKey = gs.computeZobristKey()
+        return gs
+
+    '''
+    FEN string of the current position, the inverse of fromFEN
+    '''
+    def toFEN(self):
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == 'w' else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+
+        castling = ''.join(char for bit, char in ((WKS, 'K'), (WQS, 'Q'), (BKS, 'k'), (BQS, 'q')) if self.castleRights & bit) or '-'
+        enPassant = Move.colToFile[self.enPassantPossible[1]] + Move.rowToRank[self.enPassantPossible[0]] if self.enPassantPossible else '-'
+        plies = len(self.moveLog)
+        startedWhite = self.whiteMove == (plies % 2 == 0)
+        fullmove = self.startFullmove + (plies if startedWhite else plies + 1) // 2
+        return ' '.join(('/'.join(ranks), 'w' if self.whiteMove else 'b', castling, enPassant, str(self.halfmoveClock), str(fullmove)))
+
+    '''
+    Build the piece and color bitboards from the board
+    '''
+    def loadBitboards(self):
+        self.bitboards = [0] * 12 # One bitboard per piece, ordered like ChessBitboard.PIECES
+        self.colorBitboards = [0, 0] # All white pieces, all black pieces
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    self.bitboards[PIECE_INDEX[piece]] |= 1 << (r * 8 + c)
+                    self.colorBitboards[0 if piece[0] == 'w' else 1] |= 1 << (r * 8 + c)
+
+    '''
+    Move the pieces of a move on the bitboards. Every change is a XOR, so calling it again with the same arguments undoes it
+    '''
+    def toggleBitboards(self, move, placedPiece):
+        bitboards = self.bitboards
+        start = 1 << (move.startRow * 8 + move.startCol)
+        end = 1 << (move.endRow * 8 + move.endCol)
+        color = 0 if move.pieceMoved[0] == 'w' else 1
+        bitboards[PIECE_INDEX[move.pieceMoved]] ^= start
+        bitboards[PIECE_INDEX[placedPiece]] ^= end # Differs from the moved piece on promotion
+        self.colorBitboards[color] ^= start | end
+        if move.isCapture:
+            captured = 1 << (move.startRow * 8 + move.endCol) if move.isEnpassantMove else end
+            bitboards[PIECE_INDEX[move.pieceCaptured]] ^= captured
+            self.colorBitboards[1 - color] ^= captured
+        if move.isCastleMove:
+            if move.endCol - move.startCol == 2: # Kingside, rook jumps from the right corner to the left of the king
+                rook = (1 << (move.endRow * 8 + move.endCol + 1)) | (1 << (move.endRow * 8 + move.endCol - 1))
+            else: # Queenside, rook jumps from the left corner to the right of the king
+                rook = (1 << (move.endRow * 8 + move.endCol - 2)) | (1 << (move.endRow * 8 + move.endCol + 1))
+            bitboards[color * 6 + 3] ^= rook
+            self.colorBitboards[color] ^= rook
+
+    '''
+    Hash the whole position from scratch. makeMove keeps the same value up to date incrementally
+    '''
+    def computeZobristKey(self):
+        key = self.getStateKey()
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != '--':
+                    key ^= ZOBRIST_PIECES[self.board[r][c]][r * 8 + c]
+        return key
+
+    '''
+    Hash of everything but the pieces: side to move, castle rights and the en passant file
+    '''
+    def getStateKey(self):
+        key = ZOBRIST_CASTLE[self.castleRights]
+        if not self.whiteMove:
+            key ^= ZOBRIST_BLACK_MOVE
+        if self.enPassantPossible:
+            # Only hash the file when a pawn can actually take, so positions that play the same hash the same
+            r, c = self.enPassantPossible
+            pawnRow, pawn = (r + 1, 'wP') if self.whiteMove else (r - 1, 'bP')
+            if (c > 0 and self.board[pawnRow][c - 1] == pawn) or (c < 7 and self.board[pawnRow][c + 1] == pawn):
+                key ^= ZOBRIST_EN_PASSANT[c]
+        return key
+
+    '''
+    Hash change of the pieces moved by a move, the same XORs add and remove them
+    '''
+    def getMoveKey(self, move, placedPiece):
+        key = ZOBRIST_PIECES[move.pieceMoved][move.startRow * 8 + move.startCol] ^ ZOBRIST_PIECES[placedPiece][move.endRow * 8 + move.endCol]
+        if move.isCapture:
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow # En passant takes the pawn beside the mover
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][captureRow * 8 + move.endCol]
+        if move.isCastleMove:
+            rookKeys = ZOBRIST_PIECES[move.pieceMoved[0] + 'R']
+            if move.endCol - move.startCol == 2: # Kingside
+                key ^= rookKeys[move.endRow * 8 + move.endCol + 1] ^ rookKeys[move.endRow * 8 + move.endCol - 1]
+            else: # Queenside
+                key ^= rookKeys[move.endRow * 8 + move.endCol - 2] ^ rookKeys[move.endRow * 8 + move.endCol + 1]
+        return key
+
+    '''
+    Keep a running score of the position from now on. squareScores maps every piece to its score on each of the
+    64 squares (row * 8 + col), positive is good for white
+    '''
+    def setEvaluation(self, squareScores):
+        self.squareScores = squareScores
+        self.evalScore = self.computeEvaluation()
+        self.evalPly = len(self.moveLog)
+
+    '''
+    Score the whole board from scratch. makeMove keeps the same value up to date incrementally
+    '''
+    def computeEvaluation(self):
+        score = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != '--':
+                    score += self.squareScores[self.board[r][c]][r * 8 + c]
+        return score
+
+    '''
+    Score change of a move: the moved piece changes square (and type on promotion), a captured piece leaves, a castling rook moves
     '''
-    Make a move
+    def getMoveScore(self, move, placedPiece):
+        scores = self.squareScores
+        score = scores[placedPiece][move.endRow * 8 + move.endCol] - scores[move.pieceMoved][move.startRow * 8 + move.startCol]
+        if move.isCapture:
+            captureRow = move.startRow if move.isEnpassantMove else move.endRow
+            score -= scores[move.pieceCaptured][captureRow * 8 + move.endCol]
+        if move.isCastleMove:
+            rookScores = scores[move.pieceMoved[0] + 'R']
+            if move.endCol - move.startCol == 2: # Kingside
+                score += rookScores[move.endRow * 8 + move.endCol - 1] - rookScores[move.endRow * 8 + move.endCol + 1]
+            else: # Queenside
+                score += rookScores[move.endRow * 8 + move.endCol + 1] - rookScores[move.endRow * 8 + move.endCol - 2]
+        return score
+
     '''
-    def makeMove(self, move, human=False):
+    Make a move. With legalMoves, the legal moves of the position before it, the move also gets its SAN for the move log
+    '''
+    def makeMove(self, move, human=False, legalMoves=None):
+        # Save the state of the position before the move on the undo stack
+        record = len(self.moveLog) * UNDO_RECORD
+        undoStack = self.undoStack
+        if record == len(undoStack):
+            undoStack.extend([0] * len(undoStack))
+        epSquare = self.enPassantPossible[0] * 8 + self.enPassantPossible[1] if self.enPassantPossible else NO_SQUARE
+        undoStack[record] = self.castleRights | epSquare << 4 | self.halfmoveClock << 11
+        undoStack[record + 1] = self.zobristKey
+        undoStack[record + 2] = self.evalScore
+
+        key = self.zobristKey ^ self.getStateKey() # Take out the state of the position before the move
         self.board[move.startRow][move.startCol] = '--' # When a piece is moved an empty space is left on its location
         self.board[move.endRow][move.endCol] = move.pieceMoved # The starting row and col of the moved piece are saved at the end location
         self.moveLog.append(move) # Save move in move log so we can undo it later
@@ -73,14 +329,15 @@ class GameState():
                             break
                 else:
                     self.board[move.endRow][move.endCol] = move.pieceMoved[0] + self.promotePiece.upper()
+                move.promotionPiece = self.promotePiece.upper() # Remember the human's choice on the logged move
             else:
-                self.board[move.endRow][move.endCol] = move.pieceMoved[0] + self.promotePiece.upper()
+                self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionPiece
         
         # En passant
         if move.isEnpassantMove:
             self.board[move.startRow][move.endCol] = '--' # Capturing piece with en passant
         if move.pieceMoved[1] == 'P' and abs(move.startRow - move.endRow) == 2: # If a pawn moves 2 squares
-            self.enPassantPossible = ((move.startRow + move.endRow)//2, move.startCol) # En passant square is one row before final advance in the same column
+            self.enPassantPossible = SQUARES[(move.startRow + move.endRow)//2 * 8 + move.startCol] # En passant square is one row before final advance in the same column
         else:
             self.enPassantPossible = () # Reset if any other move is made
         
@@ -93,22 +350,30 @@ class GameState():
                 self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-2] # Copy Rook to right of king
                 self.board[move.endRow][move.endCol-2] = '--' # Remove left Rook from original position
         
-        self.enPassantPossibleLog.append(self.enPassantPossible)
+        if self.useBitboards:
+            self.toggleBitboards(move, self.board[move.endRow][move.endCol])
+        key ^= self.getMoveKey(move, self.board[move.endRow][move.endCol])
+        if self.squareScores is not None:
+            self.evalScore += self.getMoveScore(move, self.board[move.endRow][move.endCol])
 
         # Update castling rights
         self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks,
-                                            self.currentCastleRights.wqs, self.currentCastleRights.bqs))
+
+        # Update the hash with the new state
+        self.zobristKey = key ^ self.getStateKey()
         
-        # Update move count for draw
-        if not move.isCapture and not self.whiteMove:
-            self.moveCountWhite += 1
-        elif not move.isCapture and self.whiteMove:
-            self.moveCountBlack += 1
-        elif move.isCapture and not self.whiteMove:
-            self.moveCountWhite = 0
-        elif move.isCapture and self.whiteMove:
-            self.moveCountBlack = 0
+        # Update the half move clock, positions before a capture or pawn move can't come back
+        if move.isCapture or move.pieceMoved[1] == 'P':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if move.isCapture:
+            self.pieceCount -= 1
+
+        # Notation of the move as played, after a human chose the promotion piece, with its check or mate
+        if legalMoves is not None:
+            replies = self.generateLegalMoves()
+            move.san = move.getAlgebraicNotation(legalMoves) + (('+' if replies else '#') if self.in_check else '')
     
     '''
     Undo a move
@@ -116,6 +381,8 @@ class GameState():
     def undoMove(self):
         if len(self.moveLog) != 0:
             move = self.moveLog.pop() # Remove and save the last made move
+            if self.useBitboards:
+                self.toggleBitboards(move, self.board[move.endRow][move.endCol]) # Read the placed piece before the board is restored
             self.board[move.startRow][move.startCol] = move.pieceMoved # Put piece in its previous position
             self.board[move.endRow][move.endCol] = move.pieceCaptured # Put back captured piece if there is one
             self.whiteMove = not self.whiteMove
@@ -131,13 +398,6 @@ class GameState():
                 self.board[move.endRow][move.endCol] = '--'
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
             
-            self.enPassantPossibleLog.pop()
-            self.enPassantPossible = self.enPassantPossibleLog[-1]
-
-            # Undo castle rights
-            self.castleRightsLog.pop() # Get rid of the new castle rights
-            self.currentCastleRights = self.castleRightsLog[-1] # Set the current castle rights as the last logged rights
-
             # Undo castle move
             if move.isCastleMove:
                 if move.endCol - move.startCol == 2: # Kingside
@@ -146,19 +406,57 @@ class GameState():
                 else: # Queenside
                     self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1] # Return left rook to original position
                     self.board[move.endRow][move.endCol+1] = '--' # Clear square right of king
-            
-            self.checkmate = False
-            self.draw = False
-            self.stalemate = False
-            self.moveCountWhite -= 1
-            self.moveCountBlack -= 1
+
+            # Restore the state saved by makeMove
+            ply = len(self.moveLog)
+            record = ply * UNDO_RECORD
+            state = self.undoStack[record]
+            self.castleRights = state & ALL_CASTLE_RIGHTS
+            self.enPassantPossible = SQUARES[(state >> 4) & 127]
+            self.halfmoveClock = state >> 11
+            self.zobristKey = self.undoStack[record + 1]
+            if move.isCapture:
+                self.pieceCount += 1
+            if self.squareScores is not None:
+                # Moves made before setEvaluation have no logged score, score the restored board instead
+                self.evalScore = self.undoStack[record + 2] if ply >= self.evalPly else self.computeEvaluation()
     
+    '''
+    True when the opponent of the side to move attacks (r, c). Only the squares a piece could attack (r, c) from are looked at,
+    no moves are generated
+    '''
     def squareUnderAttack(self, r, c):
-        self.whiteMove = not self.whiteMove # Switch moves
-        oppMoves = self.getAllMoves()
-        self.whiteMove = not self.whiteMove # Switch moves back
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
+        if self.useBitboards:
+            return self.attackersTo(r * 8 + c, 1 if self.whiteMove else 0, self.colorBitboards[0] | self.colorBitboards[1]) != 0
+        return self.boardSquareAttacked(r, c, 'b' if self.whiteMove else 'w')
+
+    '''
+    Board version of the attack test: look outward from (r, c) along every line for the first piece, then at the knight squares
+    '''
+    def boardSquareAttacked(self, r, c, enemyColor):
+        board = self.board
+        pawnRow = r + 1 if enemyColor == 'w' else r - 1 # Row an enemy pawn attacks (r, c) from
+        for directions, slider in ((ROOK_DIRECTIONS, 'R'), (BISHOP_DIRECTIONS, 'B')):
+            for dr, dc in directions:
+                endRow = r + dr
+                endCol = c + dc
+                while 0 <= endRow < 8 and 0 <= endCol < 8:
+                    piece = board[endRow][endCol]
+                    if piece != '--':
+                        if piece[0] == enemyColor:
+                            pieceType = piece[1]
+                            if pieceType == slider or pieceType == 'Q':
+                                return True
+                            if endRow == r + dr and endCol == c + dc: # Next to the square
+                                if pieceType == 'K' or (pieceType == 'P' and slider == 'B' and endRow == pawnRow):
+                                    return True
+                        break
+                    endRow += dr
+                    endCol += dc
+        for dr, dc in KNIGHT_STEPS:
+            endRow = r + dr
+            endCol = c + dc
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and board[endRow][endCol] == enemyColor + 'N':
                 return True
         return False
 
@@ -169,43 +467,15 @@ class GameState():
             return self.squareUnderAttack(self.blackKingLoc[0], self.blackKingLoc[1])
     
     def updateCastleRights(self, move):
-        if move.pieceMoved == 'wK':
-            self.currentCastleRights.wks = False
-            self.currentCastleRights.wqs = False
-        elif move.pieceMoved == 'bK':
-            self.currentCastleRights.bks = False
-            self.currentCastleRights.bqs = False
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0: # Left Rook
-                    self.currentCastleRights.wqs = False
-                elif move.startCol == 7: # Right Rook
-                    self.currentCastleRights.wks = False
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0: # Left Rook
-                    self.currentCastleRights.bqs = False
-                elif move.startCol == 7: # Right Rook
-                    self.currentCastleRights.bks = False
-        
-        if move.pieceCaptured == "wR":
-            if move.endCol == 0:  # left rook
-                self.currentCastleRights.wqs = False
-            elif move.endCol == 7:  # right rook
-                self.currentCastleRights.wks = False
-        elif move.pieceCaptured == "bR":
-            if move.endCol == 0:  # left rook
-                self.currentCastleRights.bqs = False
-            elif move.endCol == 7:  # right rook
-                self.currentCastleRights.bks = False
+        self.castleRights &= CASTLE_RIGHTS_MASK[move.startRow * 8 + move.startCol] & CASTLE_RIGHTS_MASK[move.endRow * 8 + move.endCol]
     
     def getCastleMoves(self, r, c, moves):
         inCheck = self.squareUnderAttack(r, c)
         if inCheck:
             return # Can't castle while in check
-        if (self.whiteMove and self.currentCastleRights.wks) or (not self.whiteMove and self.currentCastleRights.bks):
+        if self.castleRights & (WKS if self.whiteMove else BKS):
             self.getKingsideCastleMoves(r, c, moves)
-        if (self.whiteMove and self.currentCastleRights.wqs) or (not self.whiteMove and self.currentCastleRights.bqs):
+        if self.castleRights & (WQS if self.whiteMove else BQS):
             self.getQueensideCastleMoves(r, c, moves)
 
     def getKingsideCastleMoves(self, r, c, moves):
@@ -219,13 +489,96 @@ class GameState():
                 moves.append(Move((r, c), (r, c-2), self.board, isCastleMove=True))
     
     '''
-    Get all legal moves
+    Get all legal moves. With trackStatus on, as the UI uses it, the checkmate, stalemate and draw flags are updated too
     '''
     def getLegalMoves(self):
-        tempCastleRights = CastleRights(self.currentCastleRights.wks, self.currentCastleRights.bks,
-                                            self.currentCastleRights.wqs, self.currentCastleRights.bqs)
+        moves = self.generateLegalMoves()
+        if self.trackStatus:
+            status = self.gameStatus(moves)
+            self.checkmate = status == 'checkmate'
+            self.stalemate = status == 'stalemate'
+            self.draw = status == 'draw'
+        return moves
 
-        # Advanced algorithm
+    '''
+    Get all legal moves without touching the game over flags, for the search and perft. Sets in_check
+    '''
+    def generateLegalMoves(self):
+        if self.useBitboards:
+            return self.getBitboardMoves()
+        return self.getBoardMoves()
+
+    '''
+    'checkmate', 'stalemate' or 'draw' (threefold repetition or 50 moves), None while the game goes on.
+    Pass the moves of the last generateLegalMoves call when they are already known
+    '''
+    def gameStatus(self, moves=None):
+        if moves is None:
+            moves = self.generateLegalMoves()
+        if len(moves) == 0:
+            return 'checkmate' if self.in_check else 'stalemate'
+        if self.repetitionCount() >= 2 or self.halfmoveClock >= 100:
+            return 'draw'
+        return None
+
+    '''
+    Standard algebraic notation of a legal move in the current position (Nbd7, exd5, e8=Q+, O-O#).
+    Pass the legal moves when they are already known, they tell which moves need the start file or rank
+    '''
+    def getSAN(self, move, legalMoves=None):
+        if legalMoves is None:
+            legalMoves = self.generateLegalMoves()
+        san = move.getAlgebraicNotation(legalMoves)
+
+        # Check or mate, found by making the move
+        inCheck = self.in_check
+        self.makeMove(move)
+        replies = self.generateLegalMoves()
+        if self.in_check:
+            san += '+' if replies else '#'
+        self.undoMove()
+        self.in_check = inCheck
+        return san
+
+    '''
+    Number of times the current position was on the board before. Only every second position back to the last capture or
+    pawn move can be the same, with the same side to move, so the scan is bounded by the half move clock
+    '''
+    def repetitionCount(self):
+        key = self.zobristKey
+        undoStack = self.undoStack
+        ply = len(self.moveLog)
+        count = 0
+        for i in range(ply - 4, max(ply - self.halfmoveClock, 0) - 1, -2): # A position needs 4 plies to come back
+            if undoStack[i * UNDO_RECORD + 1] == key:
+                count += 1
+        return count
+
+    '''
+    True when the current position was on the board before. The search scores this as a draw, since the side that could
+    avoid the repetition already had the chance to
+    '''
+    def isRepetition(self):
+        key = self.zobristKey
+        undoStack = self.undoStack
+        ply = len(self.moveLog)
+        for i in range(ply - 4, max(ply - self.halfmoveClock, 0) - 1, -2):
+            if undoStack[i * UNDO_RECORD + 1] == key:
+                return True
+        return False
+
+    '''
+    Get the legal captures and promotions only, for the quiescence search. Sets in_check but not checkmate or stalemate
+    '''
+    def getCaptureMoves(self):
+        if self.useBitboards:
+            return self.getBitboardMoves(capturesOnly=True)
+        return [move for move in self.getBoardMoves() if move.isCapture or move.isPromotion]
+
+    '''
+    Get all legal moves by walking the board (Advanced algorithm)
+    '''
+    def getBoardMoves(self):
         moves = []
         self.in_check, self.pins, self.checks = self.pinsAndChecks()
 
@@ -267,31 +620,161 @@ class GameState():
                 self.getCastleMoves(self.whiteKingLoc[0], self.whiteKingLoc[1], moves)
             else:
                 self.getCastleMoves(self.blackKingLoc[0], self.blackKingLoc[1], moves)
+        return moves
 
-        # Checkmate and stalemate
-        if len(moves) == 0:
-            if self.inCheck():
-                self.checkmate = True
-            else:
-                self.stalemate = True
+    '''
+    Get all legal moves from the bitboards. Pins and checks come from rays cast out of the king, so no move is made and undone to test it.
+    With capturesOnly just the captures and promotions are generated
+    '''
+    def getBitboardMoves(self, capturesOnly=False):
+        moves = []
+        board = self.board
+        bitboards = self.bitboards
+        if self.whiteMove:
+            us, them, forward, doublePushRow, promotionRow = 0, 1, -8, 6, 1
         else:
-            self.checkmate = False
-            self.stalemate = False
-        
-        # Draw by 3 consecutive moves
-        if len(self.moveLog) >= 8:
-            for i in range(len(self.moveLog) - 8):
-                if self.moveLog[i] == self.moveLog[i+4] == self.moveLog[i+8]:
-                    self.draw = True
-                    break
-        
-        # Draw by 50 moves
-        if self.moveCountWhite == 50 or self.moveCountBlack == 50:
-            self.draw = True
-        
-        self.currentCastleRights = tempCastleRights
+            us, them, forward, doublePushRow, promotionRow = 1, 0, 8, 1, 6
+        own = self.colorBitboards[us]
+        enemy = self.colorBitboards[them]
+        occupied = own | enemy
+        base = us * 6 # Index of our pawn bitboard, the other pieces follow in PIECES order
+        enemyBase = them * 6
+
+        kingBB = bitboards[base + 5]
+        kingSq = kingBB.bit_length() - 1
+        kingSquare = divmod(kingSq, 8)
+        checkers = self.attackersTo(kingSq, them, occupied)
+        self.in_check = checkers != 0
+
+        # King moves, the king is taken off the board so it can't hide behind itself from a slider
+        targets = KING_ATTACKS[kingSq] & (enemy if capturesOnly else ~own)
+        withoutKing = occupied ^ kingBB
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            endSq = bit.bit_length() - 1
+            if not self.attackersTo(endSq, them, withoutKing):
+                moves.append(Move(kingSquare, divmod(endSq, 8), board))
+        if checkers & (checkers - 1): # Double check, king has to move
+            return moves
+
+        # Squares other pieces may move to: anywhere when not in check, otherwise block or capture the checker
+        if checkers:
+            targetMask = (BETWEEN[kingSq * 64 + checkers.bit_length() - 1] | checkers) & ~own
+        else:
+            targetMask = FULL & ~own
+            if not capturesOnly:
+                self.getBitboardCastleMoves(kingSq, kingSquare, occupied, them, moves)
+        pushMask = targetMask # Pawn pushes are never captures, with capturesOnly only promotions are kept below
+        if capturesOnly:
+            targetMask &= enemy
+
+        # Pins, an enemy slider that would see the king through exactly one of our pieces
+        pinned = 0
+        pinRays = {}
+        enemyRooks = bitboards[enemyBase + 3] | bitboards[enemyBase + 4]
+        enemyBishops = bitboards[enemyBase + 2] | bitboards[enemyBase + 4]
+        snipers = (ROOK_RAYS[kingSq] & enemyRooks) | (BISHOP_RAYS[kingSq] & enemyBishops)
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            ray = BETWEEN[kingSq * 64 + bit.bit_length() - 1]
+            blockers = ray & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinned |= blockers
+                pinRays[blockers.bit_length() - 1] = ray | bit # A pinned piece can only move along the pin
+
+        # Knights, a pinned knight can never move
+        pieces = bitboards[base + 1] & ~pinned
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length() - 1
+            self.addBitboardMoves(divmod(sq, 8), KNIGHT_ATTACKS[sq] & targetMask, moves)
+
+        # Bishops, rooks and queens
+        for index, attacks in ((base + 2, bishopAttacks), (base + 3, rookAttacks), (base + 4, bishopAttacks), (base + 4, rookAttacks)):
+            pieces = bitboards[index]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                sq = bit.bit_length() - 1
+                targets = attacks(sq, occupied) & targetMask
+                if bit & pinned:
+                    targets &= pinRays[sq]
+                self.addBitboardMoves(divmod(sq, 8), targets, moves)
+
+        # Pawns
+        empty = ~occupied
+        pieces = bitboards[base]
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length() - 1
+            startSquare = divmod(sq, 8)
+            allowed = pushMask
+            if bit & pinned:
+                allowed &= pinRays[sq]
+            targets = PAWN_ATTACKS[us][sq] & enemy & allowed
+            pushSq = sq + forward
+            if (1 << pushSq) & empty and (not capturesOnly or startSquare[0] == promotionRow): # 1 square pawn advance
+                targets |= (1 << pushSq) & allowed
+                if startSquare[0] == doublePushRow and (1 << (pushSq + forward)) & empty & allowed: # 2 square pawn advance
+                    moves.append(Move(startSquare, divmod(pushSq + forward, 8), board))
+            if startSquare[0] == promotionRow:
+                while targets:
+                    endBit = targets & -targets
+                    targets ^= endBit
+                    for piece in Move.promotionPieces:
+                        moves.append(Move(startSquare, divmod(endBit.bit_length() - 1, 8), board, promotionPiece=piece))
+            else:
+                self.addBitboardMoves(startSquare, targets, moves)
+
+            if self.enPassantPossible and PAWN_ATTACKS[us][sq] & (1 << (self.enPassantPossible[0] * 8 + self.enPassantPossible[1])):
+                # En passant takes two pieces off one rank, so test the king on the board as it would be after the capture
+                endBB = 1 << (self.enPassantPossible[0] * 8 + self.enPassantPossible[1])
+                capturedBB = 1 << (startSquare[0] * 8 + self.enPassantPossible[1])
+                afterCapture = (occupied ^ bit ^ capturedBB) | endBB
+                if not self.attackersTo(kingSq, them, afterCapture) & ~capturedBB:
+                    moves.append(Move(startSquare, self.enPassantPossible, board, isEnpassantMove=True))
         return moves
 
+    '''
+    Add a move from startSquare to every square set in targets
+    '''
+    def addBitboardMoves(self, startSquare, targets, moves):
+        board = self.board
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            moves.append(Move(startSquare, divmod(bit.bit_length() - 1, 8), board))
+
+    '''
+    Add castle moves from the bitboards, the king may not be in check, pass through or land on an attacked square
+    '''
+    def getBitboardCastleMoves(self, kingSq, kingSquare, occupied, them, moves):
+        if self.whiteMove:
+            kingside, queenside = self.castleRights & WKS, self.castleRights & WQS
+        else:
+            kingside, queenside = self.castleRights & BKS, self.castleRights & BQS
+        if kingside and not occupied & ((1 << (kingSq + 1)) | (1 << (kingSq + 2))):
+            if not self.attackersTo(kingSq + 1, them, occupied) and not self.attackersTo(kingSq + 2, them, occupied):
+                moves.append(Move(kingSquare, (kingSquare[0], kingSquare[1] + 2), self.board, isCastleMove=True))
+        if queenside and not occupied & ((1 << (kingSq - 1)) | (1 << (kingSq - 2)) | (1 << (kingSq - 3))):
+            if not self.attackersTo(kingSq - 1, them, occupied) and not self.attackersTo(kingSq - 2, them, occupied):
+                moves.append(Move(kingSquare, (kingSquare[0], kingSquare[1] - 2), self.board, isCastleMove=True))
+
+    '''
+    Bitboard of the pieces of a color (0 white, 1 black) attacking a square, with occupied as the blocking pieces
+    '''
+    def attackersTo(self, sq, color, occupied):
+        bitboards = self.bitboards
+        base = color * 6
+        return ((PAWN_ATTACKS[1 - color][sq] & bitboards[base]) | (KNIGHT_ATTACKS[sq] & bitboards[base + 1])
+                | (KING_ATTACKS[sq] & bitboards[base + 5])
+                | (bishopAttacks(sq, occupied) & (bitboards[base + 2] | bitboards[base + 4]))
+                | (rookAttacks(sq, occupied) & (bitboards[base + 3] | bitboards[base + 4])))
+
     '''
     Get all possible moves
     '''
@@ -331,13 +814,13 @@ class GameState():
 
         if self.board[row + move_amount][col] == "--":  # 1 square pawn advance
             if not piece_pinned or pin_direction == (move_amount, 0):
-                moves.append(Move((row, col), (row + move_amount, col), self.board))
+                self.addPawnMoves((row, col), (row + move_amount, col), moves)
                 if row == start_row and self.board[row + 2 * move_amount][col] == "--":  # 2 square pawn advance
                     moves.append(Move((row, col), (row + 2 * move_amount, col), self.board))
         if col - 1 >= 0:  # capture to the left
             if not piece_pinned or pin_direction == (move_amount, -1):
                 if self.board[row + move_amount][col - 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col - 1), self.board))
+                    self.addPawnMoves((row, col), (row + move_amount, col - 1), moves)
                 if (row + move_amount, col - 1) == self.enPassantPossible:
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -356,14 +839,16 @@ class GameState():
                             square = self.board[row][i]
                             if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
                                 attacking_piece = True
+                                break
                             elif square != "--":
                                 blocking_piece = True
+                                break # Only the first piece past the pawns matters
                     if not attacking_piece or blocking_piece:
                         moves.append(Move((row, col), (row + move_amount, col - 1), self.board, isEnpassantMove=True))
         if col + 1 <= 7:  # capture to the right
             if not piece_pinned or pin_direction == (move_amount, +1):
                 if self.board[row + move_amount][col + 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col + 1), self.board))
+                    self.addPawnMoves((row, col), (row + move_amount, col + 1), moves)
                 if (row + move_amount, col + 1) == self.enPassantPossible:
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -382,11 +867,23 @@ class GameState():
                             square = self.board[row][i]
                             if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
                                 attacking_piece = True
+                                break
                             elif square != "--":
                                 blocking_piece = True
+                                break # Only the first piece past the pawns matters
                     if not attacking_piece or blocking_piece:
                         moves.append(Move((row, col), (row + move_amount, col + 1), self.board, isEnpassantMove=True))
 
+    '''
+    Add a pawn move, or one move per promotion piece when the pawn reaches the last rank
+    '''
+    def addPawnMoves(self, startSq, endSq, moves):
+        if endSq[0] == 0 or endSq[0] == 7:
+            for piece in Move.promotionPieces:
+                moves.append(Move(startSq, endSq, self.board, promotionPiece=piece))
+        else:
+            moves.append(Move(startSq, endSq, self.board))
+
     '''
     Get all possible moves for a rook located at (r, c) location
     '''
@@ -586,13 +1083,6 @@ class GameState():
         return in_check, pins, checks
 
 
-class CastleRights():
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
-
 class Move():
     rankToRow = {'1' : 7, '2' : 6, '3' : 5, '4' : 4,
                 '5' : 3, '6' : 2, '7' : 1, '8' : 0} # Ranks defined by rows
@@ -601,30 +1091,43 @@ class Move():
     fileToCol = {'a' : 0, 'b' : 1, 'c' : 2, 'd' : 3,
                 'e' : 4, 'f' : 5, 'g' : 6, 'h' : 7} # Files defined by columns
     colToFile = {v:k for k, v in fileToCol.items()} # Returns chess notation of file (col 3, file d), (col 7, file h)
+
+    promotionPieces = ('Q', 'R', 'B', 'N') # A promoting pawn is generated as one move per piece
+    allowedPromotions = promotionPieces # Choices accepted from a human promoting
+
+    # Thousands of moves are made per searched node, slots keep each one small and quick to create
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'moveID',
+                 'isPromotion', 'promotionPiece', 'isEnpassantMove', 'isCapture', 'isCastleMove', 'san')
     
-    def __init__(self, startSq, endSq, board, isEnpassantMove = False, isCastleMove = False):
-        self.startRow = startSq[0] # Move from this position
-        self.startCol = startSq[1]
-        self.endRow = endSq[0] # To this position
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+    def __init__(self, startSq, endSq, board, isEnpassantMove = False, isCastleMove = False, promotionPiece = 'Q'):
+        startRow, startCol = startSq
+        endRow, endCol = endSq
+        self.startRow = startRow # Move from this position
+        self.startCol = startCol
+        self.endRow = endRow # To this position
+        self.endCol = endCol
+        self.pieceMoved = pieceMoved = board[startRow][startCol]
+        pieceCaptured = board[endRow][endCol]
+        self.moveID = startRow * 1000 + startCol * 100 + endRow * 10 + endCol
 
         # Pawn promotion
-        self.isPromotion = ((self.pieceMoved == 'wP' and self.endRow == 0) or (self.pieceMoved == 'bP' and self.endRow == 7))
-        self.allowedPromotions = ['Q', 'N', 'B', 'R']
+        self.isPromotion = (pieceMoved == 'wP' and endRow == 0) or (pieceMoved == 'bP' and endRow == 7)
+        self.promotionPiece = promotionPiece
+        if self.isPromotion and promotionPiece != 'Q':
+            self.moveID += 10000 * self.promotionPieces.index(promotionPiece) # Queen keeps the plain ID, so a clicked move matches it
 
         # En passant
         self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = 'bP' if self.pieceMoved == 'wP' else 'wP'
+        if isEnpassantMove:
+            pieceCaptured = 'bP' if pieceMoved == 'wP' else 'wP'
+        self.pieceCaptured = pieceCaptured
         
         #Piece Captured
-        self.isCapture = self.pieceCaptured != '--'
+        self.isCapture = pieceCaptured != '--'
         
         # Castling
         self.isCastleMove = isCastleMove
+        self.san = None # Set by GameState.makeMove when the move is played on the board
 
     # Overloading the equals function because we can't compare two objects of different types
     def __eq__(self, other): 
@@ -632,40 +1135,101 @@ class Move():
             return self.moveID == other.moveID
         return False
     
+    '''
+    SAN of the move once it was played with makeMove's legalMoves, coordinate notation before
+    '''
     def __str__(self):
-        # Castle move
+        return self.san if self.san is not None else self.getChessNotation()
+
+    '''
+    SAN of the move without the check or mate mark, which needs the position after it. legalMoves, the legal moves of the
+    position, tell whether another piece of the same kind can go to the same square
+    '''
+    def getAlgebraicNotation(self, legalMoves):
         if self.isCastleMove:
-            return 'O-O' if self.endCol == 6 else 'O-O-O'
-        
+            return 'O-O' if self.endCol > self.startCol else 'O-O-O'
         endSquare = self.getFileRank(self.endRow, self.endCol)
-
-        # Pawn moves
         if self.pieceMoved[1] == 'P':
-            if self.isCapture and self.isPromotion:
-                return self.colToFile[self.startCol] + 'x' + endSquare + GameState().promotePiece
-            elif self.isCapture:
-                return self.colToFile[self.startCol] + 'x' + endSquare
-            elif self.isPromotion:
-                return endSquare + GameState().promotePiece
+            san = self.colToFile[self.startCol] + 'x' + endSquare if self.isCapture else endSquare
+            if self.isPromotion:
+                san += '=' + self.promotionPiece
+            return san
+        san = self.pieceMoved[1]
+        others = [other for other in legalMoves if other.pieceMoved == self.pieceMoved and other.endRow == self.endRow
+                  and other.endCol == self.endCol and (other.startRow, other.startCol) != (self.startRow, self.startCol)]
+        if others: # Another piece of the same kind can go there too
+            if all(other.startCol != self.startCol for other in others):
+                san += self.colToFile[self.startCol]
+            elif all(other.startRow != self.startRow for other in others):
+                san += self.rowToRank[self.startRow]
             else:
-                return endSquare
-        
-        # Other piece moves
-        moveString = self.pieceMoved[1]
-        if GameState().checkmate:
-            print('checkmate')
-            moveString += 'X'
-        elif GameState().check:
-            print('inCheck')
-            moveString += '+'
-        elif self.isCapture:
-            moveString += 'x'
-        
-        return moveString + endSquare
-    
+                san += self.getFileRank(self.startRow, self.startCol)
+        return san + ('x' if self.isCapture else '') + endSquare
+
     def getChessNotation(self):
         # This method returns (a0, h0) which is not like real chess but it's close
-        return self.getFileRank(self.startRow, self.startCol) + self.getFileRank(self.endRow, self.endCol)
+        notation = self.getFileRank(self.startRow, self.startCol) + self.getFileRank(self.endRow, self.endCol)
+        if self.isPromotion:
+            notation += self.promotionPiece.lower() # e7e8q, as in long algebraic notation
+        return notation
 
     def getFileRank(self, row, col):
-        return self.colToFile[col] + self.rowToRank[row]
\ No newline at end of file
+        return self.colToFile[col] + self.rowToRank[row]
+
+'''
+Read an EPD file one line at a time, yielding (fen, operations) for every position without loading the whole file.
+The FEN gets the clocks from the hmvc and fmvn operations, or the two numbers after the fields when the line has them
+(as in perft suites), otherwise "0 1". operations maps every opcode to its operands, e.g. {'bm': ['Nf3'], 'id': ['pos 1']}
+'''
+def readEPD(path):
+    with open(path) as epdFile:
+        for line in epdFile:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(None, 4)
+            if len(fields) < 4:
+                continue
+            rest = fields[4] if len(fields) > 4 else ''
+            clocks = rest.split(None, 2)
+            if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit(): # FEN with its clocks
+                rest = clocks[2] if len(clocks) > 2 else ''
+            else:
+                clocks = None
+
+            operations = {}
+            for operation in splitEPDOperations(rest):
+                opcode, *operands = operation
+                operations[opcode] = operands
+            if clocks is None:
+                clocks = (operations['hmvc'][0] if 'hmvc' in operations else '0', operations['fmvn'][0] if 'fmvn' in operations else '1')
+            yield ' '.join(fields[:4] + list(clocks[:2])), operations
+
+'''
+Split the operations of an EPD line at the semicolons into lists of words, keeping quoted strings whole
+'''
+def splitEPDOperations(text):
+    words = []
+    word = ''
+    quoted = False
+    for char in text:
+        if char == '"':
+            if quoted:
+                words.append(word) # Even an empty string is an operand
+                word = ''
+            quoted = not quoted
+        elif quoted:
+            word += char
+        elif char == ';' or char.isspace():
+            if word:
+                words.append(word)
+                word = ''
+            if char == ';' and words:
+                yield words
+                words = []
+        else:
+            word += char
+    if word:
+        words.append(word)
+    if words:
+        yield words
@@ -1,8 +1,7 @@
 # User input and current game state
-import ChessEngine, ChessAI
+import ChessEngine, ChessAI, ChessWorker
 import pygame as pg
 import sys
-from multiprocessing import Queue, Process
 
 # Global variables
 DIMENSION = 8 # Board is 8x8
@@ -10,9 +9,17 @@ BOARD_WIDTH = BOARD_HEIGHT = 800 # Screen size
 LOG_SCREEN_WIDTH = 300
 LOG_SCREEN_HEIGHT = BOARD_HEIGHT
 SQ_SIZE = BOARD_WIDTH // DIMENSION
-MAX_FPS = 144
+MAX_FPS = 144 # Frame rate of the move animation
+LOG_MOVES_PER_ROW = 3
+LOG_PADDING = 15
+LOG_LINE_SPACING = 2
+AI_THINK_TIME = 3 # Seconds the AI searches per move
+PONDER = True # The AI searches on the human's time, starting after the reply it expects
+AI_WORKERS = 1 # 1 searches inside the AI process with the tables it keeps between moves. More splits the root moves between a pool of that many processes kept between moves, which share the best root score of each depth but not their transposition tables
 IMAGES = {}
 BLACK = (0, 0, 0)
+AI_EVENT = pg.USEREVENT # Posted by the search worker whenever it sends something back
+HANDLED_EVENTS = [pg.QUIT, pg.VIDEOEXPOSE, pg.MOUSEBUTTONDOWN, pg.KEYDOWN, AI_EVENT] # Anything else, mouse motion most of all, doesn't wake the loop
 
 def main():
     pg.init() # Initialize pygame
@@ -21,9 +28,12 @@ def main():
     screen.fill(pg.Color("white")) # Fill screen with background color
     moveLogFont = pg.font.SysFont('Arial', 16, False, False)
     pg.display.set_caption('Chess')
+    pg.event.set_blocked(None)
+    pg.event.set_allowed(HANDLED_EVENTS)
 
     gs = ChessEngine.GameState() # This is where we initialze the game state
     loadImages() # Load images in only once before the main loop
+    view = BoardView(screen, moveLogFont) # Draws what changed since the last frame
 
     legalMoves = gs.getLegalMoves() # List of legal moves
     moveMade = False # Flag for move made
@@ -34,18 +44,33 @@ def main():
     playerOne = True # If a human is playing white, then this is true. If an AI is playing white, then it's false
     playerTwo = False # Same as above, but for black
     AIThinking = False
-    moveFinderProcess = None
+    aiWorker = ChessWorker.SearchWorker(workers=AI_WORKERS, notify=lambda: pg.event.post(pg.event.Event(AI_EVENT))) # Searches in the background, keeping its own copy of the game
+    view.drawGameState(gs, legalMoves, selectedSquare) # First frame, the loop only draws after an event
+    view.update()
 
     while True:
         # If it's white's move and playerOne is true, then playerOne is a human. Same for black's move
         humanTurn = (gs.whiteMove and playerOne) or (not gs.whiteMove and playerTwo)
 
-        # Quit game
-        for event in pg.event.get():
+        # AI move finder, the move comes back as an AI_EVENT
+        if not gameOver and not humanTurn and not AIThinking:
+            AIThinking = True
+            print('Thinking...')
+            aiWorker.startSearch(AI_THINK_TIME)
+        elif PONDER and humanTurn and not (playerOne and playerTwo) and not gameOver and not aiWorker.pondering:
+            print('Pondering...')
+            aiWorker.startPonder()
+
+        # Sleep until there is an event, then handle every one waiting
+        for event in [pg.event.wait()] + pg.event.get():
             if event.type == pg.QUIT:
+                aiWorker.close()
                 pg.quit()
                 sys.exit()
 
+            elif event.type == pg.VIDEOEXPOSE: # The window was covered, draw all of it again
+                view.invalidate()
+
             # Mouse handler
             elif event.type == pg.MOUSEBUTTONDOWN:
                 if not gameOver: # If it's not game over and it's the human's turn, the player can use click events
@@ -64,7 +89,8 @@ def main():
                         print(move.getChessNotation())
                         for i in range(len(legalMoves)):
                             if move == legalMoves[i]:
-                                gs.makeMove(legalMoves[i], humanTurn) # Make a move after 2nd click
+                                gs.makeMove(legalMoves[i], humanTurn, legalMoves) # Make a move after 2nd click
+                                aiWorker.makeMove(legalMoves[i])
                                 moveMade = True
                                 animate = True
                                 selectedSquare = () # After 2nd click, deselect
@@ -76,11 +102,15 @@ def main():
             elif event.type == pg.KEYDOWN:
                 if event.key == pg.K_z: # Undo a move
                     gs.undoMove()
+                    aiWorker.undoMove() # Also cancels the search when the AI is thinking
+                    AIThinking = False
                     moveMade = True
                     animate = False
                     gameOver = False
                 if event.key == pg.K_r: # Reset game
                     gs = ChessEngine.GameState()
+                    aiWorker.setPosition()
+                    AIThinking = False
                     legalMoves = gs.getLegalMoves()
                     selectedSquare = ()
                     clicks = []
@@ -88,44 +118,38 @@ def main():
                     animate = False
                     gameOver = False
         
-        # AI move finder
-        if not gameOver and not humanTurn:
-            if not AIThinking:
-                AIThinking = True
-                print('Thinking...')
-                retrunQueue = Queue()
-                moveFinderProcess = Process(target=ChessAI.getBestMove, args=(gs, legalMoves, retrunQueue))
-                moveFinderProcess.start()
-
-            if not moveFinderProcess.is_alive():
-                print("Done thinking")
-                AIMove = retrunQueue.get()
-                if AIMove is None:
-                    AIMove = ChessAI.getRandomMove(legalMoves, gs)
-                gs.makeMove(AIMove)
-                moveMade = True
-                animate = True
-                AIThinking = False
+
+            # Reply of the search worker
+            elif event.type == AI_EVENT:
+                AIMove = aiWorker.getResult(legalMoves)
+                if AIThinking and not aiWorker.searching: # Not a search cancelled by undo or reset
+                    print("Done thinking")
+                    if AIMove is None:
+                        AIMove = ChessAI.getRandomMove(legalMoves, gs)
+                    gs.makeMove(AIMove, legalMoves=legalMoves)
+                    aiWorker.makeMove(AIMove)
+                    moveMade = True
+                    animate = True
+                    AIThinking = False
 
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
+                animateMove(gs.moveLog[-1], view, gs.board, clock)
             moveMade = False
             animate = False
             legalMoves = gs.getLegalMoves()
 
-        # These need to be in the loop to generate the display, tick and game state so the game can run
-        drawGameState(screen, gs, legalMoves, selectedSquare, moveLogFont)
-
+        gameOverText = None
         if gs.checkmate or gs.stalemate:
             gameOver = True
-            drawGameOverText(screen, 'Stalemate' if gs.stalemate else 'White wins by checkmate' if not gs.whiteMove else 'Black wins by checkmate')
+            gameOverText = 'Stalemate' if gs.stalemate else 'White wins by checkmate' if not gs.whiteMove else 'Black wins by checkmate'
         if gs.draw:
             gameOver = True
-            drawGameOverText(screen, 'Draw')
+            gameOverText = 'Draw'
 
-        clock.tick(MAX_FPS)
-        pg.display.flip()
+        # Draws only what the events changed, nothing at all for an info message of the search
+        view.drawGameState(gs, legalMoves, selectedSquare, gameOverText)
+        view.update()
 
 def loadImages():
     pieces = ["bP", "bR", "bN", "bB", "bQ", "bK", "wP", "wR", "wN", "wB", "wQ", "wK"]
@@ -133,48 +157,182 @@ def loadImages():
         # Load chest pieces into IMAGES by transforming their size into 8x8
         IMAGES[piece] = pg.transform.scale(pg.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
 
-def highlightMoves(screen, gs, legalMoves, selectedSquare):
-    if selectedSquare != (): # If the selected square is not empty
-        r, c = selectedSquare
-        if gs.board[r][c][0] == ('w' if gs.whiteMove else 'b'): # Selected square is a piece that can be moved
-            # Highlight selected square
+'''
+Draws the game onto the screen, redrawing only the squares whose piece or highlight changed since the last frame, and the
+move log only after a move. The changed areas are collected and sent to the display together by update
+'''
+class BoardView():
+    def __init__(self, screen, moveLogFont):
+        self.screen = screen
+        self.moveLogFont = moveLogFont
+        self.background = renderBoard() # Empty board, copied from instead of drawing the squares again
+        self.highlights = {}
+        for highlight, color in (('selected', 'blue'), ('target', 'yellow')):
             s = pg.Surface((SQ_SIZE, SQ_SIZE))
             s.set_alpha(100) # Transparency. 0 means fully transparent. 255 not transparent at all
-            s.fill(pg.Color('blue'))
-            screen.blit(s, (SQ_SIZE*c, SQ_SIZE*r))
-            # Highlight valid moves
-            s.fill(pg.Color('yellow'))
-            for move in legalMoves:
-                if move.startRow == r and move.startCol == c:
-                    screen.blit(s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
+            s.fill(pg.Color(color))
+            self.highlights[highlight] = s
+        self.logLines = [] # (text, rendered surface) of every line of the move log
+        self.logMoves = [] # Moves logLines were made from
+        self.dirtyRects = []
+        self.invalidate()
+
+    '''
+    Forget what is on the screen, the next frame draws everything
+    '''
+    def invalidate(self):
+        self.shown = [[None] * DIMENSION for row in range(DIMENSION)] # (piece, highlight) drawn on every square
+        self.logState = None # (length, last move) of the move log drawn
+        self.shownLog = None # Line drawn at every place of the move log
+        self.shownText = None
+        self.textRect = None
+        self.dirtyRects = [pg.Rect(0, 0, BOARD_WIDTH + LOG_SCREEN_WIDTH, BOARD_HEIGHT)]
+
+    def drawGameState(self, gs, legalMoves, selectedSquare, gameOverText=None):
+        highlights = getHighlights(gs, legalMoves, selectedSquare)
+        if gameOverText != self.shownText and self.textRect is not None:
+            self.markArea(self.textRect) # The squares under the old text are drawn again
+        redrawn = self.drawSquares(gs.board, highlights)
+        if gameOverText is not None and (gameOverText != self.shownText or any(rect.colliderect(self.textRect) for rect in redrawn)):
+            self.textRect = drawGameOverText(self.screen, gameOverText)
+            self.dirtyRects.append(self.textRect)
+        self.shownText = gameOverText
+
+        self.drawMoveLog(gs.moveLog)
+
+    '''
+    Draw the lines of the move log that changed. Lines are rendered once and kept, only the lines from the first move that
+    was made or taken back since the last frame are built again, which is the last line. Once the log is longer than the
+    screen the last lines are shown
+    '''
+    def drawMoveLog(self, moveLog):
+        logState = (len(moveLog), moveLog[-1] if moveLog else None)
+        if logState == self.logState:
+            return # No move since the last frame
+        self.logState = logState
+        kept = min(len(self.logMoves), len(moveLog))
+        while kept > 0 and self.logMoves[kept - 1] is not moveLog[kept - 1]:
+            kept -= 1 # Taken back and replaced by another move
+        if kept < len(self.logMoves) or kept < len(moveLog):
+            del self.logMoves[kept:]
+            self.logMoves.extend(moveLog[kept:])
+            pliesPerLine = 2 * LOG_MOVES_PER_ROW
+            del self.logLines[kept // pliesPerLine:]
+            for start in range(len(self.logLines) * pliesPerLine, len(moveLog), pliesPerLine):
+                text = getMoveLogLine(moveLog, start)
+                self.logLines.append((text, self.moveLogFont.render(text, 0, pg.Color('White'))))
 
-def drawGameState(screen, gs, legalMoves, selectedSquare, moveLogFont):
-    drawBoard(screen)
-    highlightMoves(screen, gs, legalMoves, selectedSquare)
-    drawPieces(screen, gs.board)
-    drawMoveLog(screen, gs, moveLogFont)
+        if self.shownLog is None: # Nothing drawn yet
+            moveLogRect = pg.Rect(BOARD_WIDTH, 0, LOG_SCREEN_WIDTH, LOG_SCREEN_HEIGHT)
+            pg.draw.rect(self.screen, pg.Color('Black'), moveLogRect)
+            self.dirtyRects.append(moveLogRect)
+            self.shownLog = []
+        lineHeight = self.moveLogFont.get_linesize() + LOG_LINE_SPACING
+        visibleLines = (LOG_SCREEN_HEIGHT - 2 * LOG_PADDING) // lineHeight
+        firstLine = max(0, len(self.logLines) - visibleLines)
+        shownLines = self.shownLog
+        self.shownLog = [None] * visibleLines
+        for i in range(visibleLines):
+            line = self.logLines[firstLine + i] if firstLine + i < len(self.logLines) else None
+            self.shownLog[i] = line
+            if i < len(shownLines) and line is shownLines[i]:
+                continue # Same line already there
+            lineRect = pg.Rect(BOARD_WIDTH, LOG_PADDING + i * lineHeight, LOG_SCREEN_WIDTH, lineHeight)
+            pg.draw.rect(self.screen, pg.Color('Black'), lineRect)
+            if line is not None:
+                self.screen.blit(line[1], lineRect.move(LOG_PADDING, 0))
+            self.dirtyRects.append(lineRect)
 
-def drawBoard(screen):
-    global colors
+    '''
+    Draw every square whose piece or highlight isn't the one on the screen. board[r][c] is replaced by overrides[(r, c)] when given.
+    Returns the rects drawn
+    '''
+    def drawSquares(self, board, highlights, overrides={}):
+        redrawn = []
+        for row in range(DIMENSION):
+            for col in range(DIMENSION):
+                square = (overrides.get((row, col), board[row][col]), highlights.get((row, col)))
+                if square != self.shown[row][col]:
+                    redrawn.append(self.drawSquare(row, col, *square))
+        return redrawn
+
+    def drawSquare(self, row, col, piece, highlight=None):
+        rect = pg.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != '--':
+            self.screen.blit(IMAGES[piece], rect)
+        self.shown[row][col] = (piece, highlight)
+        self.dirtyRects.append(rect)
+        return rect
+
+    '''
+    Draw the squares under rect again, from what they show
+    '''
+    def restoreArea(self, rect):
+        for row in range(max(rect.top // SQ_SIZE, 0), min((rect.bottom - 1) // SQ_SIZE + 1, DIMENSION)):
+            for col in range(max(rect.left // SQ_SIZE, 0), min((rect.right - 1) // SQ_SIZE + 1, DIMENSION)):
+                self.drawSquare(row, col, *self.shown[row][col])
+
+    '''
+    Make the squares under rect be drawn again by the next frame
+    '''
+    def markArea(self, rect):
+        for row in range(max(rect.top // SQ_SIZE, 0), min((rect.bottom - 1) // SQ_SIZE + 1, DIMENSION)):
+            for col in range(max(rect.left // SQ_SIZE, 0), min((rect.right - 1) // SQ_SIZE + 1, DIMENSION)):
+                self.shown[row][col] = None
+
+    '''
+    Send the areas drawn since the last update to the display
+    '''
+    def update(self):
+        if self.dirtyRects:
+            pg.display.update(self.dirtyRects)
+            self.dirtyRects = []
+
+'''
+The empty board, drawn once
+'''
+def renderBoard():
+    board = pg.Surface((BOARD_WIDTH, BOARD_HEIGHT))
     colors = [pg.Color("white"), pg.Color("gray")]
     for row in range(DIMENSION):
         for col in range(DIMENSION):
             color = colors[((col + row) % 2)] # Odd sum means white tile, even sum means gray tile
-            pg.draw.rect(screen, color, pg.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))            
+            pg.draw.rect(board, color, pg.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    return board
 
-def drawPieces(screen, board):
-    for row in range(DIMENSION):
-        for col in range(DIMENSION):
-            piece = board[row][col]
-            if piece != '--':
-                screen.blit(IMAGES[piece], pg.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+'''
+Highlight of every highlighted square: the selected square when it holds a piece that can be moved, and the squares it can move to
+'''
+def getHighlights(gs, legalMoves, selectedSquare):
+    highlights = {}
+    if selectedSquare != (): # If the selected square is not empty
+        r, c = selectedSquare
+        if gs.board[r][c][0] == ('w' if gs.whiteMove else 'b'): # Selected square is a piece that can be moved
+            highlights[(r, c)] = 'selected'
+            for move in legalMoves:
+                if move.startRow == r and move.startCol == c:
+                    highlights[(move.endRow, move.endCol)] = 'target'
+    return highlights
 
-def animateMove(move, screen, board, clock):
-    global colors
+'''
+Slide the moved piece from its start to its end square. The board is first shown as after the move but with the captured piece
+still on its square, then every frame only the squares under the piece's last and new place are drawn again
+'''
+def animateMove(move, view, board, clock):
     dR = move.endRow - move.startRow # Change in row
     dC = move.endCol - move.startCol # Change in column
     framesPerSquare = 10 # How many frames will it take for the piece to move one square
     framesCount = (abs(dR) + abs(dC)) * framesPerSquare # How many frames will the animation be -> squares to move times framesPerSquare
+
+    # Erase the piece moved from its ending square, the captured piece stays until the moving piece covers it
+    overrides = {(move.endRow, move.endCol): '--' if move.isEnpassantMove else move.pieceCaptured}
+    if move.isEnpassantMove:
+        overrides[(move.startRow, move.endCol)] = move.pieceCaptured
+    view.drawSquares(board, {}, overrides)
+    pieceRect = None
     for frame in range(framesCount + 1):
         '''
         Save the coordinates in r, c.
@@ -183,26 +341,18 @@ def animateMove(move, screen, board, clock):
         So, 1/30 of the coordinates is saved. Then, 2/30 of the coordinates, then 3/30 and so on until 30/30 when the piece gets to it's ending location
         '''
         r, c = (move.startRow + dR*frame/framesCount, move.startCol + dC*frame/framesCount)
-        drawBoard(screen)
-        drawPieces(screen, board) # Drawing the board and pieces of the ending position
-        
-        # Erase the piece moved from its ending square
-        color = colors[((move.endRow + move.endCol) % 2)]
-        endSquare = pg.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        pg.draw.rect(screen, color, endSquare) # Draw over the piece at the ending position
-
-        # Draw captured piece onto rectangle
-        if move.pieceCaptured != '--':
-            if move.isEnpassantMove:
-                enPassantRow = move.endRow + 1 if move.pieceCaptured[0] == 'b' else move.endRow - 1
-                endSquare = pg.Rect(move.endCol*SQ_SIZE, enPassantRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        
-        # Draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], pg.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        pg.display.flip()
+        if pieceRect is not None:
+            view.restoreArea(pieceRect) # Take the piece away from where it was drawn last frame
+        pieceRect = pg.Rect(round(c*SQ_SIZE), round(r*SQ_SIZE), SQ_SIZE, SQ_SIZE)
+        view.screen.blit(IMAGES[move.pieceMoved], pieceRect)
+        view.dirtyRects.append(pieceRect)
+        view.update()
         clock.tick(MAX_FPS)
+    view.markArea(pieceRect) # The end square is drawn with its real piece by the next frame
 
+'''
+Draw the text in the middle of the board and return the area it covers
+'''
 def drawGameOverText(screen, text):
     font = pg.font.SysFont('Helvetica', 32, True, False)
     textObject = font.render(text, 0, pg.Color('Gray'))
@@ -210,31 +360,19 @@ def drawGameOverText(screen, text):
     screen.blit(textObject, textLocation)
     textObject = font.render(text, 0, pg.Color('Black'))
     screen.blit(textObject, textLocation.move(2, 2))
+    return pg.Rect(textLocation.left, textLocation.top, textObject.get_width() + 2, textObject.get_height() + 2)
 
-def drawMoveLog(screen, gs, font):
-    moveLogRect = pg.Rect(BOARD_WIDTH, 0, LOG_SCREEN_WIDTH, LOG_SCREEN_HEIGHT)
-    pg.draw.rect(screen, pg.Color('Black'), moveLogRect)
-    moveLog = gs.moveLog
+'''
+Text of the move log line starting at ply start, LOG_MOVES_PER_ROW moves to a line. Moves are shown by their SAN, set when they were made
+'''
+def getMoveLogLine(moveLog, start):
     moveText = []
-    for i in range(0, len(moveLog), 2):
+    for i in range(start, min(start + 2 * LOG_MOVES_PER_ROW, len(moveLog)), 2):
         moveString = str(i//2 + 1) + '. ' + str(moveLog[i]) + ' '
         if i+1 < len(moveLog):
             moveString += str(moveLog[i+1]) + '    '
         moveText.append(moveString)
-    
-    movesPerRow = 3
-    padding = 15
-    lineSpacing = 2
-    textY = padding
-    for i in range(0, len(moveText), movesPerRow):
-        text = ''
-        for j in range(movesPerRow):
-            if i+j < len(moveText):
-                text += moveText[i+j]
-        textObject = font.render(text, 0, pg.Color('White'))
-        textLocation = moveLogRect.move(padding, textY)
-        screen.blit(textObject, textLocation)
-        textY += textObject.get_height() + lineSpacing
+    return ''.join(moveText)
 
 
 if __name__ == "__main__":
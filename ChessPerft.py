@@ -0,0 +1,169 @@
+# Perft: count the leaf nodes of the legal move tree to check move generation and measure its speed
+import argparse
+import sys
+import time
+import ChessEngine
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Reference positions with their known node counts per depth
+PERFT_POSITIONS = [
+    ('startpos', START_FEN,
+        {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ('position3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ('position4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+        {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ('position4 mirrored', 'r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1',
+        {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ('position5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+        {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ('position6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+        {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ('illegal en passant 1', '3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',
+        {1: 18, 2: 92, 3: 1670, 4: 10138, 5: 185429, 6: 1134888}),
+    ('illegal en passant 2', '8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1',
+        {1: 13, 2: 102, 3: 1266, 4: 10276, 5: 135655, 6: 1015133}),
+    ('en passant gives check', '8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1',
+        {1: 15, 2: 126, 3: 1928, 4: 13931, 5: 206379, 6: 1440467}),
+    ('short castle gives check', '5k2/8/8/8/8/8/8/4K2R w K - 0 1',
+        {1: 15, 2: 66, 3: 1198, 4: 6399, 5: 120330, 6: 661072}),
+    ('long castle gives check', '3k4/8/8/8/8/8/8/R3K3 w Q - 0 1',
+        {1: 16, 2: 71, 3: 1286, 4: 7418, 5: 141077, 6: 803711}),
+    ('castle rights', 'r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1',
+        {1: 26, 2: 1141, 3: 27826, 4: 1274206}),
+    ('castling prevented', 'r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1',
+        {1: 44, 2: 1494, 3: 50509, 4: 1720476}),
+    ('promote out of check', '2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1',
+        {1: 11, 2: 133, 3: 1442, 4: 19174, 5: 266199, 6: 3821001}),
+    ('discovered check', '8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1',
+        {1: 29, 2: 165, 3: 5160, 4: 31961, 5: 1004658}),
+    ('promote to give check', '4k3/1P6/8/8/8/8/K7/8 w - - 0 1',
+        {1: 9, 2: 40, 3: 472, 4: 2661, 5: 38983, 6: 217342}),
+    ('underpromote to give check', '8/P1k5/K7/8/8/8/8/8 w - - 0 1',
+        {1: 6, 2: 27, 3: 273, 4: 1329, 5: 18135, 6: 92683}),
+    ('self stalemate', 'K1k5/8/P7/8/8/8/8/8 w - - 0 1',
+        {1: 2, 2: 6, 3: 13, 4: 63, 5: 382, 6: 2217}),
+    ('stalemate and checkmate 1', '8/k1P5/8/1K6/8/8/8/8 w - - 0 1',
+        {1: 10, 2: 25, 3: 268, 4: 926, 5: 10857, 6: 43261, 7: 567584}),
+    ('stalemate and checkmate 2', '8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1',
+        {1: 37, 2: 183, 3: 6559, 4: 23527}),
+]
+
+'''
+Number of leaf nodes depth plies below the current position. The last ply is counted from the move list without making the moves
+'''
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.generateLegalMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+'''
+Perft split by root move, for finding which move a wrong count comes from
+'''
+def divide(gs, depth):
+    counts = []
+    for move in gs.generateLegalMoves():
+        gs.makeMove(move)
+        counts.append((move.getChessNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return sorted(counts)
+
+'''
+Run perft on one position and print the node count, time and nodes per second
+'''
+def runPerft(fen, depth, showDivide=False, useBitboards=True):
+    gs = ChessEngine.GameState.fromFEN(fen, useBitboards)
+    start = time.perf_counter()
+    if showDivide:
+        counts = divide(gs, depth)
+        nodes = sum(count for _, count in counts)
+    else:
+        nodes = perft(gs, depth)
+    seconds = time.perf_counter() - start
+    if showDivide:
+        for notation, count in counts:
+            print(notation + ': ' + str(count))
+        print()
+    print('Nodes: ' + str(nodes) + '  Time: ' + format(seconds, '.2f') + 's  NPS: ' + str(int(nodes / max(seconds, 1e-9))))
+    return nodes, seconds
+
+'''
+Run every reference position at the deepest known depth up to maxDepth. Returns True when every count matches
+'''
+def runSuite(maxDepth, useBitboards=True):
+    passed = True
+    totalNodes = 0
+    totalSeconds = 0
+    for name, fen, expected in PERFT_POSITIONS:
+        depths = [depth for depth in expected if depth <= maxDepth]
+        if not depths:
+            continue # Only known deeper than asked
+        depth = max(depths)
+        gs = ChessEngine.GameState.fromFEN(fen, useBitboards)
+        start = time.perf_counter()
+        nodes = perft(gs, depth)
+        seconds = time.perf_counter() - start
+        totalNodes += nodes
+        totalSeconds += seconds
+        ok = nodes == expected[depth]
+        passed = passed and ok
+        print('{:<28} depth {}  {:>9} nodes  {:>7.2f}s  {:>8} nps  {}'.format(
+            name, depth, nodes, seconds, int(nodes / max(seconds, 1e-9)), 'ok' if ok else 'FAIL, expected ' + str(expected[depth])))
+    print('Total: ' + str(totalNodes) + ' nodes in ' + format(totalSeconds, '.2f') + 's, ' + str(int(totalNodes / max(totalSeconds, 1e-9))) + ' nps')
+    return passed
+
+'''
+Run perft on every position of an EPD file with perft counts as D1 20 ;D2 400 ... operations, up to maxDepth.
+Positions are read one at a time, so the file can be any size. Returns True when every count matches
+'''
+def runEPD(path, maxDepth, useBitboards=True):
+    passed = True
+    positions = 0
+    totalNodes = 0
+    start = time.perf_counter()
+    for fen, operations in ChessEngine.readEPD(path):
+        expected = {int(opcode[1:]) : int(operands[0]) for opcode, operands in operations.items()
+                    if opcode[0] == 'D' and opcode[1:].isdigit() and int(opcode[1:]) <= maxDepth}
+        if not expected:
+            continue
+        depth = max(expected)
+        nodes = perft(ChessEngine.GameState.fromFEN(fen, useBitboards), depth)
+        positions += 1
+        totalNodes += nodes
+        if nodes != expected[depth]:
+            passed = False
+            print('FAIL ' + fen + ' depth ' + str(depth) + ': ' + str(nodes) + ', expected ' + str(expected[depth]))
+    seconds = time.perf_counter() - start
+    print(str(positions) + ' positions, ' + str(totalNodes) + ' nodes in ' + format(seconds, '.2f') + 's, ' + str(int(totalNodes / max(seconds, 1e-9))) + ' nps')
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description='Count legal move tree leaves to check and time move generation')
+    parser.add_argument('--fen', help='position to count from, the reference suite runs when left out')
+    parser.add_argument('--epd', help='EPD file of positions with D1, D2... perft counts to check instead of the reference suite')
+    parser.add_argument('--depth', type=int, default=3, help='plies to search (suite: deepest reference depth to run)')
+    parser.add_argument('--divide', action='store_true', help='print the node count below every root move')
+    parser.add_argument('--board', action='store_true', help='generate moves by walking the board instead of from bitboards')
+    args = parser.parse_args()
+
+    if args.fen:
+        runPerft(args.fen, args.depth, args.divide, not args.board)
+    elif args.epd:
+        if not runEPD(args.epd, args.depth, not args.board):
+            sys.exit(1)
+    elif not runSuite(args.depth, not args.board):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+# Endgame tablebases: the exact result and distance to mate of every position of a material balance with up to MAX_PIECES pieces,
+# kings included. A table holds one byte per position with the stronger side as white: 0 for a draw, otherwise the plies to
+# mate + 1, so odd when the side to move gets mated and even when it mates. Tables are built here by retrograde analysis,
+# written to TABLEBASE_DIR and read by the search through memory maps.
+# Build the default tables with: python ChessTablebase.py    and others with e.g.: python ChessTablebase.py KQKR KRKP
+# 3 piece tables take seconds, 4 piece tables minutes each and 5 to 16 MB
+import argparse
+import itertools
+import mmap
+import os
+import random
+import time
+from array import array
+import ChessEngine
+from ChessBitboard import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, rookAttacks, bishopAttacks, queenAttacks
+
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebases')
+MAX_PIECES = 4
+DEFAULT_TABLES = ('KQK', 'KRK', 'KPK')
+PIECE_ORDER = 'KQRBNP' # Order of the pieces of a side in a table, and in its name
+PIECE_VALUES = {'Q' : 9, 'R' : 5, 'B' : 3, 'N' : 3, 'P' : 1}
+PROMOTIONS = 'QRBN'
+MAX_PLIES = 254 # Longest distance to mate a byte holds
+
+# Scores of positions during generation, for the side to move
+WIN = 1000 # Less the plies to mate
+NO_EXIT = -32000 # No move leaves the table
+
+# Generation state of a position
+UNKNOWN = 0
+DONE = 1
+SKIPPED = 2 # Illegal, or a mirror image of a position that is stored
+
+# The 8 symmetries of the board. Tables with pawns only use the first two, pawns can't be turned or flipped upside down
+TRANSFORMS = tuple(tuple(transform(sq >> 3, sq & 7) for sq in range(64)) for transform in (
+    lambda r, c: r * 8 + c, lambda r, c: r * 8 + 7 - c, lambda r, c: (7 - r) * 8 + c, lambda r, c: (7 - r) * 8 + 7 - c,
+    lambda r, c: c * 8 + r, lambda r, c: c * 8 + 7 - r, lambda r, c: (7 - c) * 8 + r, lambda r, c: (7 - c) * 8 + 7 - r))
+TRIANGLE = tuple(sq for sq in range(64) if sq >> 3 >= 4 and 7 - (sq >> 3) <= (sq & 7) <= 3) # a1-d1-d4, white king squares without pawns
+PAWN_KING_SQUARES = tuple(sq for sq in range(64) if sq & 7 <= 3) # Files a to d, white king squares with pawns
+
+'''
+Index layout of one table: the side to move, the white king square out of its reduced set, then the square of every other piece
+in table order. The white king is turned into its set with the board symmetries and equal pieces are kept in square order,
+the other images of a position are left unused
+'''
+class TableLayout():
+    def __init__(self, name):
+        blackKing = name.index('K', 1)
+        self.name = name
+        self.kinds = name
+        self.colors = (0,) * blackKing + (1,) * (len(name) - blackKing)
+        self.kings = (0, blackKing)
+        self.kingSquares = PAWN_KING_SQUARES if 'P' in name else TRIANGLE
+        self.kingSlots = [-1] * 64
+        for slot, sq in enumerate(self.kingSquares):
+            self.kingSlots[sq] = slot
+        transforms = TRANSFORMS[:2] if 'P' in name else TRANSFORMS
+        self.kingTransforms = tuple(tuple(transform for transform in transforms if self.kingSlots[transform[sq]] != -1) for sq in range(64))
+        self.groups = [] # (start, end) of every run of equal pieces
+        start = 1
+        for end in range(2, len(name) + 1):
+            if end == len(name) or name[end] != name[start] or self.colors[end] != self.colors[start]:
+                if end - start > 1:
+                    self.groups.append((start, end))
+                start = end
+        self.size = 2 * len(self.kingSquares) * 64 ** (len(name) - 1)
+
+    '''
+    Index of the stored image of the position
+    '''
+    def index(self, side, squares):
+        best = None
+        for transform in self.kingTransforms[squares[0]]:
+            mapped = [transform[sq] for sq in squares]
+            for start, end in self.groups:
+                mapped[start:end] = sorted(mapped[start:end])
+            if best is None or mapped < best:
+                best = mapped
+        index = side * len(self.kingSquares) + self.kingSlots[best[0]]
+        for sq in best[1:]:
+            index = index * 64 + sq
+        return index
+
+    '''
+    Side to move and piece squares of an index
+    '''
+    def decode(self, index):
+        squares = [0] * len(self.kinds)
+        for i in range(len(self.kinds) - 1, 0, -1):
+            index, squares[i] = divmod(index, 64)
+        side, slot = divmod(index, len(self.kingSquares))
+        squares[0] = self.kingSquares[slot]
+        return side, squares
+
+'''
+Squares attacked by a piece, pawns only attack diagonally
+'''
+def pieceAttacks(kind, side, sq, occupied):
+    if kind == 'K':
+        return KING_ATTACKS[sq]
+    elif kind == 'N':
+        return KNIGHT_ATTACKS[sq]
+    elif kind == 'B':
+        return bishopAttacks(sq, occupied)
+    elif kind == 'R':
+        return rookAttacks(sq, occupied)
+    elif kind == 'Q':
+        return queenAttacks(sq, occupied)
+    return PAWN_ATTACKS[side][sq]
+
+'''
+True when a piece of side attacks target. The piece with index skip is left out, it was just captured
+'''
+def isAttacked(layout, target, side, squares, occupied, skip=-1):
+    for i, sq in enumerate(squares):
+        if layout.colors[i] == side and i != skip and pieceAttacks(layout.kinds[i], side, sq, occupied) >> target & 1:
+            return True
+    return False
+
+def isLegal(layout, side, squares):
+    occupied = 0
+    for i, sq in enumerate(squares):
+        if occupied >> sq & 1:
+            return False # Two pieces on one square
+        if layout.kinds[i] == 'P' and sq >> 3 in (0, 7):
+            return False
+        occupied |= 1 << sq
+    return not isAttacked(layout, squares[layout.kings[1 - side]], side, squares, occupied)
+
+'''
+Legal moves of side as (squares after the move, index of the moved piece, index of the captured piece or -1, promotion piece or None).
+There is no castling or en passant in the tables
+'''
+def generateMoves(layout, side, squares):
+    kinds = layout.kinds
+    colors = layout.colors
+    occupied = own = 0
+    for i, sq in enumerate(squares):
+        occupied |= 1 << sq
+        if colors[i] == side:
+            own |= 1 << sq
+    king = layout.kings[side]
+    moves = []
+    for i, sq in enumerate(squares):
+        if colors[i] != side:
+            continue
+        kind = kinds[i]
+        if kind == 'P':
+            step = -8 if side == 0 else 8
+            targets = PAWN_ATTACKS[side][sq] & occupied & ~own
+            if not occupied >> (sq + step) & 1:
+                targets |= 1 << (sq + step)
+                if sq >> 3 == (6 if side == 0 else 1) and not occupied >> (sq + 2 * step) & 1:
+                    targets |= 1 << (sq + 2 * step)
+        else:
+            targets = pieceAttacks(kind, side, sq, occupied) & ~own
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            target = bit.bit_length() - 1
+            captured = squares.index(target) if occupied & bit else -1
+            after = list(squares)
+            after[i] = target
+            if isAttacked(layout, after[king], 1 - side, after, occupied ^ (1 << sq) | bit, captured):
+                continue # Leaves the king in check
+            if kind == 'P' and target >> 3 in (0, 7):
+                for piece in PROMOTIONS:
+                    moves.append((after, i, captured, piece))
+            else:
+                moves.append((after, i, captured, None))
+    return moves
+
+'''
+Indexes of the positions, side of the other colour to move, that reach the position with a move that stays in the table
+'''
+def getPredecessors(layout, side, squares):
+    mover = 1 - side
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    predecessors = set()
+    for i, sq in enumerate(squares):
+        if layout.colors[i] != mover:
+            continue
+        if layout.kinds[i] == 'P':
+            back = 8 if mover == 0 else -8 # White pawns came from the row below
+            origins = 0
+            if 1 <= (sq + back) >> 3 <= 6 and not occupied >> (sq + back) & 1:
+                origins = 1 << (sq + back)
+                if sq >> 3 == (4 if mover == 0 else 3) and not occupied >> (sq + 2 * back) & 1:
+                    origins |= 1 << (sq + 2 * back)
+        else:
+            origins = pieceAttacks(layout.kinds[i], mover, sq, occupied) & ~occupied # Moves are reversible, only the square has to be empty
+        while origins:
+            bit = origins & -origins
+            origins ^= bit
+            before = list(squares)
+            before[i] = bit.bit_length() - 1
+            predecessors.add(layout.index(mover, before))
+    return predecessors
+
+'''
+Score for the side that moved into a position with this table value
+'''
+def moverScore(value):
+    if value == 0:
+        return 0
+    return WIN - value if value % 2 == 1 else -WIN + value # value is the plies to mate of the position + 1, so the mover's plies to mate
+
+'''
+True when the pieces (kings left out) can't mate at all
+'''
+def isDrawnMaterial(pieces):
+    return pieces in ('', 'B', 'N')
+
+'''
+Name of the table of a material balance, e.g. ('R', 'P') gives 'KRKP', and whether colours have to be swapped to use it because
+black is the stronger side. None when the material can't mate
+'''
+def getTableName(white, black):
+    white = ''.join(sorted(white, key=PIECE_ORDER.index))
+    black = ''.join(sorted(black, key=PIECE_ORDER.index))
+    if isDrawnMaterial(white + black):
+        return None, False
+    def strength(pieces):
+        return sum(PIECE_VALUES[piece] for piece in pieces), [-PIECE_ORDER.index(piece) for piece in pieces]
+    if strength(black) > strength(white):
+        return 'K' + black + 'K' + white, True
+    return 'K' + white + 'K' + black, False
+
+'''
+Tables a table's captures and promotions lead to
+'''
+def getDependencies(name):
+    blackKing = name.index('K', 1)
+    sides = [name[1:blackKing], name[blackKing + 1:]]
+    dependencies = set()
+    for side in (0, 1):
+        own, enemy = sides[side], sides[1 - side]
+        for i in range(len(own)): # One piece captured
+            changed = [None, None]
+            changed[side] = own[:i] + own[i + 1:]
+            changed[1 - side] = enemy
+            dependencies.add(getTableName(*changed)[0])
+        for i in range(len(enemy) + 1): # A pawn of the other side promotes, maybe capturing piece i
+            if 'P' not in enemy:
+                break
+            for piece in PROMOTIONS:
+                promoted = enemy.replace('P', piece, 1)
+                changed = [None, None]
+                changed[side] = own[:i] + own[i + 1:] if i < len(own) else own
+                changed[1 - side] = promoted
+                dependencies.add(getTableName(*changed)[0])
+    dependencies.discard(None)
+    return dependencies
+
+'''
+The tables found in a directory, opened on first use
+'''
+class Tablebases():
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {} # Name: (layout, values), None when there is no file
+
+    def getTable(self, name):
+        if name not in self.tables:
+            table = None
+            path = os.path.join(self.directory, name + '.tb')
+            if os.path.exists(path):
+                layout = TableLayout(name)
+                if os.path.getsize(path) == layout.size:
+                    with open(path, 'rb') as tableFile:
+                        table = (layout, mmap.mmap(tableFile.fileno(), 0, access=mmap.ACCESS_READ))
+                else:
+                    print('Tablebase {} has the wrong size, left out'.format(path))
+            self.tables[name] = table
+        return self.tables[name]
+
+    '''
+    Table value of a position given as (colour, kind, square) pieces, colour 0 for white. None when its table isn't there
+    '''
+    def lookup(self, pieces, side):
+        white = [kind for color, kind, sq in pieces if color == 0 and kind != 'K']
+        black = [kind for color, kind, sq in pieces if color == 1 and kind != 'K']
+        name, swap = getTableName(white, black)
+        if name is None:
+            return 0
+        table = self.getTable(name)
+        if table is None:
+            return None
+        layout, values = table
+        if swap: # Black is the stronger side, look up the colour swapped image
+            pieces = [(1 - color, kind, sq ^ 56) for color, kind, sq in pieces]
+            side = 1 - side
+        squares = [sq for color, kind, sq in sorted(pieces, key=lambda piece: (piece[0], PIECE_ORDER.index(piece[1])))]
+        return values[layout.index(side, squares)]
+
+    '''
+    Result of the game state for the side to move from the tables: (1 win, 0 draw or -1 loss, plies to mate).
+    None when there are too many pieces, the table isn't there, or castling or en passant is possible, which the tables leave out
+    '''
+    def probe(self, gs):
+        if gs.pieceCount > MAX_PIECES or gs.castleRights:
+            return None
+        if gs.enPassantPossible:
+            r, c = gs.enPassantPossible
+            pawnRow = r + 1 if gs.whiteMove else r - 1
+            pawn = 'wP' if gs.whiteMove else 'bP'
+            if (c > 0 and gs.board[pawnRow][c - 1] == pawn) or (c < 7 and gs.board[pawnRow][c + 1] == pawn):
+                return None
+        pieces = [(0 if piece[0] == 'w' else 1, piece[1], r * 8 + c) for r, row in enumerate(gs.board) for c, piece in enumerate(row) if piece != '--']
+        value = self.lookup(pieces, 0 if gs.whiteMove else 1)
+        if value is None:
+            return None
+        if value == 0:
+            return 0, 0
+        plies = value - 1
+        return (1 if plies % 2 else -1), plies
+
+'''
+Retrograde analysis of one table. Every position is first scored from its moves out of the table (captures and promotions,
+looked up in the smaller tables) and its checkmates. Then, going up in distance to mate, every decided position decides the
+positions before it: one move into a lost position wins, and a position is lost once all its moves in the table are known to
+lose and no move out of the table does better. What is left undecided is a draw
+'''
+def generateTable(layout, tablebases):
+    size = layout.size
+    values = bytearray(size)
+    state = bytearray(size)
+    counts = bytearray(size) # Moves in the table that aren't known to lose yet
+    exits = array('h', [NO_EXIT]) * size # Best score of the moves out of the table
+    buckets = [[] for plies in range(MAX_PLIES + 2)] # Positions to decide the positions before of, by plies to mate. Negative for a win out of the table still to check
+    kinds = layout.kinds
+    colors = layout.colors
+
+    index = 0
+    for side in (0, 1):
+        for kingSquare in layout.kingSquares:
+            for rest in itertools.product(range(64), repeat=len(kinds) - 1):
+                squares = (kingSquare,) + rest
+                if not isLegal(layout, side, squares) or layout.index(side, squares) != index:
+                    state[index] = SKIPPED
+                    index += 1
+                    continue
+                successors = set()
+                best = NO_EXIT
+                moves = generateMoves(layout, side, squares)
+                for after, moved, captured, promotion in moves:
+                    if captured == -1 and promotion is None:
+                        successors.add(layout.index(1 - side, after))
+                    else:
+                        pieces = [(colors[i], promotion if i == moved and promotion else kinds[i], sq) for i, sq in enumerate(after) if i != captured]
+                        best = max(best, moverScore(tablebases.lookup(pieces, 1 - side)))
+                if not moves:
+                    state[index] = DONE
+                    occupied = sum(1 << sq for sq in squares)
+                    if isAttacked(layout, squares[layout.kings[side]], 1 - side, squares, occupied): # Checkmate
+                        values[index] = 1
+                        buckets[0].append(index)
+                elif not successors: # Every move leaves the table
+                    state[index] = DONE
+                    if best != 0:
+                        plies = WIN - best if best > 0 else best + WIN
+                        values[index] = plies + 1
+                        buckets[plies].append(index)
+                else:
+                    counts[index] = len(successors)
+                    exits[index] = best
+                    if best > 0:
+                        buckets[WIN - best].append(~index)
+                index += 1
+
+    for plies in range(MAX_PLIES + 1):
+        for index in buckets[plies]:
+            if index < 0: # Win out of the table, unless a quicker one in the table was found
+                index = ~index
+                if state[index] != UNKNOWN:
+                    continue
+                state[index] = DONE
+                values[index] = plies + 1
+            side, squares = layout.decode(index)
+            for predecessor in getPredecessors(layout, side, squares):
+                if state[predecessor] != UNKNOWN:
+                    continue
+                if plies % 2 == 0: # Lost for the side to move, so won for the side that moved into it
+                    state[predecessor] = DONE
+                    values[predecessor] = plies + 2
+                    buckets[plies + 1].append(predecessor)
+                else:
+                    counts[predecessor] -= 1
+                    best = exits[predecessor]
+                    if counts[predecessor] == 0 and best < 0: # Lost, as late as the best move out of the table allows
+                        lossPlies = plies + 1 if best == NO_EXIT else max(plies + 1, best + WIN)
+                        if lossPlies > MAX_PLIES:
+                            raise ValueError('{} has a mate longer than {} plies'.format(layout.name, MAX_PLIES))
+                        state[predecessor] = DONE
+                        values[predecessor] = lossPlies + 1
+                        buckets[lossPlies].append(predecessor)
+    return values
+
+'''
+Generate a table and the tables it depends on when they aren't in the directory yet
+'''
+def buildTable(name, tablebases):
+    if tablebases.getTable(name) is not None:
+        return
+    for dependency in sorted(getDependencies(name)):
+        buildTable(dependency, tablebases)
+    print('Generating {}...'.format(name))
+    start = time.perf_counter()
+    layout = TableLayout(name)
+    values = generateTable(layout, tablebases)
+    os.makedirs(tablebases.directory, exist_ok=True)
+    with open(os.path.join(tablebases.directory, name + '.tb'), 'wb') as tableFile:
+        tableFile.write(values)
+    del tablebases.tables[name] # Opened again from the file
+    wins = sum(1 for value in values if value and value % 2 == 0)
+    losses = sum(1 for value in values if value % 2 == 1)
+    print('{}: {} positions, {} won and {} lost for the side to move, longest mate {} plies, {:.1f}s'.format(
+        name, layout.size, wins, losses, max(max(values) - 1, 0), time.perf_counter() - start))
+
+'''
+Check random positions of a table against the moves GameState generates: the value of each has to follow from the values
+of the positions after its moves
+'''
+def verifyTable(name, samples, tablebases):
+    layout, values = tablebases.getTable(name)
+    rng = random.Random(0)
+    checked = errors = 0
+    while checked < samples:
+        index = rng.randrange(layout.size)
+        side, squares = layout.decode(index)
+        if not isLegal(layout, side, squares) or layout.index(side, squares) != index:
+            continue
+        board = [['--'] * 8 for r in range(8)]
+        for i, sq in enumerate(squares):
+            board[sq >> 3][sq & 7] = 'wb'[layout.colors[i]] + layout.kinds[i]
+        gs = ChessEngine.GameState.fromBoard(board, side == 0, trackStatus=False)
+        moves = gs.generateLegalMoves()
+        if not moves:
+            expected = 1 if gs.in_check else 0
+        else:
+            best = NO_EXIT
+            for move in moves:
+                gs.makeMove(move)
+                replies = gs.generateLegalMoves()
+                if replies:
+                    result = tablebases.probe(gs)
+                    if result is None: # En passant is possible, which the tables leave out
+                        gs.enPassantPossible = ()
+                        result = tablebases.probe(gs)
+                    value = 0 if result[0] == 0 else result[1] + 1
+                else:
+                    value = 1 if gs.in_check else 0
+                best = max(best, moverScore(value))
+                gs.undoMove()
+            expected = 0 if best == 0 else (WIN - best if best > 0 else best + WIN) + 1
+        if values[index] != expected:
+            errors += 1
+            print('{}: table has {}, moves give {}'.format(gs.toFEN(), values[index], expected))
+        checked += 1
+    print('{}: {} positions checked, {} wrong'.format(name, checked, errors))
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate endgame tablebases of up to {} pieces'.format(MAX_PIECES))
+    parser.add_argument('tables', nargs='*', default=DEFAULT_TABLES, help='material balances, e.g. KQK KRKP (default: {})'.format(' '.join(DEFAULT_TABLES)))
+    parser.add_argument('--dir', default=TABLEBASE_DIR, help='directory of the table files')
+    parser.add_argument('--verify', type=int, default=0, help='positions of every table to check against GameState')
+    args = parser.parse_args()
+    tablebases = Tablebases(args.dir)
+    for table in args.tables:
+        name, _ = getTableName(*table.upper()[1:].split('K', 1))
+        if name is None or len(name) > MAX_PIECES:
+            parser.error('{} is no table of up to {} pieces with mating material'.format(table, MAX_PIECES))
+        buildTable(name, tablebases)
+        if args.verify:
+            verifyTable(name, args.verify, tablebases)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# UCI front end, so the engine can be used from chess GUIs and match runners: python ChessUCI.py
+# Commands are read on the main thread and every search runs on its own thread, so stop is answered while it searches
+import sys
+import threading
+import time
+import ChessEngine, ChessAI, ChessTablebase
+from ChessPerft import START_FEN
+
+ENGINE_NAME = 'ChessAI'
+ENGINE_AUTHOR = 'TrenBoro'
+MOVES_TO_GO = 30 # Moves the remaining clock time is shared between when the GUI doesn't say
+MOVE_OVERHEAD = 0.05 # Seconds kept back per move for the GUI and the pipes
+
+class UCIEngine():
+    def __init__(self):
+        self.gs = ChessEngine.GameState.fromFEN(START_FEN, trackStatus=False)
+        self.searchThread = None
+        self.stopEvent = threading.Event()
+        self.outputLock = threading.Lock()
+        ChessAI.stopRequested = self.stopEvent.is_set
+
+    def send(self, line):
+        with self.outputLock:
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+
+    '''
+    Read commands until quit or the end of input
+    '''
+    def run(self):
+        for line in sys.stdin:
+            words = line.split()
+            if not words:
+                continue
+            command = words[0]
+            if command == 'uci':
+                self.send('id name ' + ENGINE_NAME)
+                self.send('id author ' + ENGINE_AUTHOR)
+                self.send('option name Hash type spin default {} min 1 max 4096'.format(ChessAI.TT_SIZE_MB))
+                self.send('option name OwnBook type check default {}'.format('true' if ChessAI.USE_BOOK else 'false'))
+                self.send('uciok')
+            elif command == 'isready':
+                self.send('readyok')
+            elif command == 'setoption':
+                self.setOption(words)
+            elif command == 'ucinewgame':
+                self.stopSearch()
+                ChessAI.tt.clear()
+            elif command == 'position':
+                self.stopSearch()
+                self.setPosition(words)
+            elif command == 'go':
+                self.stopSearch()
+                self.startSearch(words)
+            elif command == 'stop':
+                self.stopSearch()
+            elif command == 'quit':
+                break
+        self.stopSearch()
+
+    def setOption(self, words):
+        if 'name' in words and 'value' in words:
+            name = ' '.join(words[words.index('name') + 1:words.index('value')])
+            value = ' '.join(words[words.index('value') + 1:])
+            if name.lower() == 'hash':
+                self.stopSearch()
+                ChessAI.tt = ChessAI.TranspositionTable(int(value))
+            elif name.lower() == 'ownbook':
+                ChessAI.USE_BOOK = value.lower() == 'true'
+
+    '''
+    position startpos [moves e2e4 ...] or position fen <fen> [moves ...]
+    '''
+    def setPosition(self, words):
+        movesAt = words.index('moves') if 'moves' in words else len(words)
+        fen = START_FEN if words[1] == 'startpos' else ' '.join(words[2:movesAt])
+        gs = ChessEngine.GameState.fromFEN(fen, trackStatus=False)
+        for notation in words[movesAt + 1:]:
+            for move in gs.generateLegalMoves():
+                if move.getChessNotation() == notation:
+                    gs.makeMove(move)
+                    break
+            else:
+                self.send('info string illegal move ' + notation)
+                break
+        self.gs = gs
+
+    '''
+    go [depth D] [nodes N] [movetime MS] [wtime MS btime MS winc MS binc MS movestogo N] [infinite]
+    '''
+    def startSearch(self, words):
+        options = {}
+        for i, word in enumerate(words[:-1]):
+            if word in ('depth', 'nodes', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo'):
+                options[word] = int(words[i + 1])
+
+        timeLimit = None
+        if 'movetime' in options:
+            timeLimit = max(options['movetime'] / 1000 - MOVE_OVERHEAD, 0.01)
+        elif ('wtime' if self.gs.whiteMove else 'btime') in options:
+            remaining = options['wtime' if self.gs.whiteMove else 'btime'] / 1000
+            increment = options.get('winc' if self.gs.whiteMove else 'binc', 0) / 1000
+            timeLimit = remaining / options.get('movestogo', MOVES_TO_GO) + increment * 0.75
+            timeLimit = max(min(timeLimit, remaining / 2 - MOVE_OVERHEAD), 0.01) # Never risk the clock on one move
+        nodeLimit = options.get('nodes')
+        maxDepth = options.get('depth')
+        infinite = 'infinite' in words
+        if maxDepth is None and timeLimit is None and nodeLimit is None:
+            maxDepth = ChessAI.MAX_DEPTH # go infinite, or go with nothing, searches until stop
+
+        self.stopEvent.clear()
+        self.searchThread = threading.Thread(target=self.search, args=(self.gs, timeLimit, nodeLimit, maxDepth, infinite), daemon=True)
+        self.searchThread.start()
+
+    def stopSearch(self):
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+    '''
+    Body of the search thread: iterative deepening with an info line per finished depth, then bestmove
+    '''
+    def search(self, gs, timeLimit, nodeLimit, maxDepth, infinite):
+        legalMoves = gs.generateLegalMoves()
+        if not legalMoves:
+            self.send('info depth 0 score ' + ('mate 0' if gs.in_check else 'cp 0'))
+            self.send('bestmove 0000')
+            return
+        bookMove = ChessAI.getBookMove(gs, legalMoves) if not infinite else None # An infinite search is analysis, the book would cut it short
+        if bookMove is not None:
+            self.send('info string book move')
+            self.send('bestmove ' + bookMove.getChessNotation())
+            return
+        start = time.perf_counter()
+
+        def reportIteration(depth, bestMove, score):
+            seconds = time.perf_counter() - start
+            pv = ChessAI.principalVariation
+            if abs(score) >= ChessAI.MATE_SCORE: # Mate on the board, the score is CHECKMATE less the plies to it
+                plies = ChessAI.CHECKMATE - abs(score)
+                scoreText = 'mate {}'.format((plies + 1) // 2 if score > 0 else -(plies // 2))
+            elif abs(score) > ChessAI.TB_WIN - ChessTablebase.MAX_PLIES: # Tablebase result, the plies to mate are counted from the probed position
+                plies = ChessAI.TB_WIN - abs(score) + 1
+                scoreText = 'mate {}'.format((plies + 1) // 2 if score > 0 else -(plies // 2))
+            else:
+                scoreText = 'cp {}'.format(round(score * 100)) # Scores are in pawns
+            self.send('info depth {} score {} nodes {} nps {} time {} pv {}'.format(depth, scoreText, ChessAI.nodeCount, int(ChessAI.nodeCount / max(seconds, 1e-9)),
+                                                                                  int(seconds * 1000), ' '.join(move.getChessNotation() for move in pv)))
+
+        bestMove, _ = ChessAI.iterativeDeepening(gs, legalMoves, reportIteration, timeLimit, nodeLimit, maxDepth)
+        if infinite:
+            self.stopEvent.wait() # The GUI decides when an infinite search ends, even one that found a mate
+        self.send('bestmove ' + bestMove.getChessNotation())
+
+def main():
+    UCIEngine().run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# Long lived AI process. It keeps its own copy of the game, updated move by move over a pipe, so its transposition table
+# and move ordering tables stay warm for the whole game and no process has to be started for every AI move.
+# That holds for the default of one worker, with more every search forks that many processes with empty tables
+import multiprocessing
+import queue
+import threading
+import time
+import ChessEngine, ChessAI
+
+'''
+Handle to the search process, used by the UI. Moves are sent in coordinate notation (e2e4, e7e8q), positions as FEN.
+A thread reads the replies of the worker as they come and calls notify after each one, so the UI can sleep until then
+instead of polling
+'''
+class SearchWorker():
+    def __init__(self, fen=None, workers=1, notify=None):
+        self.connection, workerConnection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=runWorker, args=(workerConnection, fen, workers))
+        self.process.start()
+        workerConnection.close() # Only the worker's end stays open, so the reader sees the end of the pipe when it quits
+        self.messages = queue.Queue()
+        self.notify = notify
+        self.reader = threading.Thread(target=self.readMessages, daemon=True)
+        self.reader.start()
+        self.searchID = 0
+        self.searching = False
+        self.bestMove = None # Notation of the best move of the last finished iteration
+        self.ponderMove = None # Reply the last search expects to its move, None when it doesn't know one
+        self.pondering = False
+        self.searchStats = None # SearchStats.toDict() of the last finished search, sent back with its move
+
+    '''
+    Start a new game from fen, the starting position when None
+    '''
+    def setPosition(self, fen=None):
+        self.stop()
+        self.pondering = False
+        self.ponderMove = None
+        self.connection.send(('position', fen))
+
+    '''
+    Play move in the worker's game. While pondering this tells the worker whether the reply it expected was played
+    '''
+    def makeMove(self, move):
+        notation = move.getChessNotation()
+        if self.pondering and notation == self.ponderMove:
+            self.connection.send(('ponderhit',)) # The worker already played it
+        else:
+            self.connection.send(('move', notation))
+        if self.pondering:
+            self.pondering = False
+            self.ponderMove = None
+
+    def undoMove(self):
+        self.stop()
+        self.pondering = False
+        self.ponderMove = None
+        self.connection.send(('undo',))
+
+    '''
+    Search the current position in the background, getResult gives the move once the search is done
+    '''
+    def startSearch(self, timeLimit=None, nodeLimit=None, maxDepth=None):
+        self.searchID += 1
+        self.searching = True
+        self.bestMove = None
+        self.ponderMove = None
+        self.connection.send(('go', self.searchID, timeLimit, nodeLimit, maxDepth))
+
+    '''
+    Search on the opponent's time until its move is made: after the reply the last search expects when there is one, and
+    otherwise the current position, which still fills the transposition table for every reply. Nothing is sent back, when
+    the expected reply is played the next startSearch takes what the worker found so far
+    '''
+    def startPonder(self):
+        self.stop()
+        self.searchID += 1
+        self.pondering = True
+        self.connection.send(('ponder', self.searchID, self.ponderMove))
+
+    '''
+    Cancel the running search, its result is thrown away
+    '''
+    def stop(self):
+        if self.searching:
+            self.connection.send(('stop',))
+            self.searching = False
+
+    '''
+    Body of the reader thread
+    '''
+    def readMessages(self):
+        while True:
+            try:
+                message = self.connection.recv()
+            except EOFError: # The worker quit
+                break
+            self.messages.put(message)
+            if self.notify is not None:
+                self.notify()
+
+    '''
+    Go through the messages of the worker without blocking. Returns the move out of legalMoves once the search is done, None
+    while it runs. searching is False again once the search is done
+    '''
+    def getResult(self, legalMoves):
+        while not self.messages.empty():
+            message, searchID, notation, ponderMove, stats = self.messages.get()
+            if searchID != self.searchID or not self.searching:
+                continue # Left over from a cancelled search
+            if notation is not None:
+                self.bestMove = notation
+            if message == 'bestmove':
+                self.searching = False
+                self.ponderMove = ponderMove
+                self.searchStats = stats
+                for move in legalMoves:
+                    if move.getChessNotation() == self.bestMove:
+                        return move
+        return None
+
+    def close(self):
+        self.stop()
+        self.connection.send(('quit',))
+        self.process.join()
+        self.reader.join() # No notify after close returns
+
+'''
+Sends the move of every finished iteration back to the UI, in place of the queue getBestMove reports to
+'''
+class IterationReporter():
+    def __init__(self, connection, searchID):
+        self.connection = connection
+        self.searchID = searchID
+
+    def put(self, move):
+        self.connection.send(('info', self.searchID, move.getChessNotation() if move else None, None, None))
+
+'''
+Search the position and return the notation of the best move and of the reply its principal variation expects, None
+for either when the search doesn't have one, and SearchStats.toDict() of the search
+'''
+def searchPosition(gs, legalMoves, returnQueue, timeLimit, nodeLimit, maxDepth, workers):
+    bestMove, stats = ChessAI.getBestMoveParallel(gs, legalMoves, returnQueue, timeLimit, nodeLimit, maxDepth, workers)
+    if bestMove is None:
+        return None, None, stats.toDict()
+    ponderMove = ChessAI.getPonderMove(gs, bestMove)
+    return bestMove.getChessNotation(), ponderMove.getChessNotation() if ponderMove else None, stats.toDict()
+
+'''
+Play the move with this notation on gs, False when it isn't legal
+'''
+def makeNotationMove(gs, notation):
+    for move in gs.generateLegalMoves():
+        if move.getChessNotation() == notation:
+            gs.makeMove(move)
+            return True
+    return False
+
+'''
+Main loop of the worker process. Any message arriving during a search cancels it, 'stop' is only sent for that.
+A ponder search plays the expected reply on gs first and searches until the next message: 'ponderhit' keeps the reply
+and the result for the next 'go', anything else takes the reply back before it's handled. Pondering, and the search
+finishing it after a hit, always run in this process, on the opponent's time one core is enough and its table is warm
+'''
+def runWorker(connection, fen, workers):
+    gs = ChessEngine.GameState.fromFEN(fen) if fen else ChessEngine.GameState()
+    ChessAI.stopRequested = connection.poll
+    ponderMade = False # The expected reply is on gs
+    ponderResult = None # (best move, ponder move, seconds searched, finished, stats) of the ponder search after the expected reply
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError: # The UI is gone
+            break
+        command = message[0]
+        if command == 'ponderhit':
+            ponderMade = False # The reply was played, gs is right
+            continue
+        if ponderMade: # Guessed wrong
+            gs.undoMove()
+            ponderMade = False
+            ponderResult = None
+        if command == 'position':
+            gs = ChessEngine.GameState.fromFEN(message[1]) if message[1] else ChessEngine.GameState()
+            ponderResult = None
+        elif command == 'move':
+            makeNotationMove(gs, message[1])
+            ponderResult = None
+        elif command == 'undo':
+            gs.undoMove()
+            ponderResult = None
+        elif command == 'ponder':
+            ponderMade = message[2] is not None and makeNotationMove(gs, message[2])
+            ponderResult = None
+            startTime = time.perf_counter()
+            legalMoves = gs.generateLegalMoves()
+            if legalMoves:
+                bestMove, ponderMove, stats = searchPosition(gs, legalMoves, queue.Queue(), None, None, ChessAI.MAX_DEPTH, 1)
+                if ponderMade and bestMove is not None:
+                    ponderResult = (bestMove, ponderMove, time.perf_counter() - startTime, not connection.poll(), stats) # Nothing pending, the search ended by itself
+        elif command == 'go':
+            searchID, timeLimit, nodeLimit, maxDepth = message[1:]
+            legalMoves = gs.generateLegalMoves()
+            bestMove = ponderMove = stats = None
+            if ponderResult is not None and (ponderResult[3] or (timeLimit is not None and ponderResult[2] >= timeLimit)):
+                bestMove, ponderMove, stats = ponderResult[0], ponderResult[1], ponderResult[4] # Searched as long as this search would on the opponent's time
+                print('PONDER hit ' + bestMove)
+            elif legalMoves:
+                searchWorkers = workers
+                if ponderResult is not None:
+                    searchWorkers = 1 # Go on from the table the ponder search filled, new processes would start empty
+                    if timeLimit is not None:
+                        timeLimit -= ponderResult[2]
+                bestMove, ponderMove, stats = searchPosition(gs, legalMoves, IterationReporter(connection, searchID), timeLimit, nodeLimit, maxDepth, searchWorkers)
+            ponderResult = None
+            if bestMove is None:
+                stats = None
+            connection.send(('bestmove', searchID, bestMove, ponderMove, stats))
+        elif command == 'quit':
+            break
@@ -0,0 +1,29 @@
+# Search regression tests: python -m pytest
+import ChessAI, ChessEngine
+from ChessPerft import PERFT_POSITIONS
+
+KIWIPETE = dict((name, fen) for name, fen, _ in PERFT_POSITIONS)['kiwipete']
+
+'''
+(move, score) of a fixed depth search of fen with a cold transposition table and no move ordering history
+'''
+def searchScore(fen, depth, monkeypatch, **settings):
+    with monkeypatch.context() as patch: # Settings only last for this search
+        patch.setattr(ChessAI, 'USE_BOOK', False)
+        patch.setattr(ChessAI, 'historyScores', ([0] * 4096, [0] * 4096))
+        for name, value in settings.items():
+            patch.setattr(ChessAI, name, value)
+        ChessAI.tt.clear()
+        gs = ChessEngine.GameState.fromFEN(fen)
+        scores = []
+        move, stats = ChessAI.iterativeDeepening(gs, gs.generateLegalMoves(), lambda depth, move, score: scores.append(score), maxDepth=depth)
+    return move.getChessNotation(), round(scores[-1], 2)
+
+'''
+Null windows and aspiration windows must give the score of a full window search without delta pruning
+'''
+def testPVSMatchesFullWindow(monkeypatch):
+    reference = searchScore(KIWIPETE, 3, monkeypatch, ASPIRATION_DEPTH=99, DELTA_MARGIN=1e9)
+    assert searchScore(KIWIPETE, 3, monkeypatch) == reference
+    assert searchScore(KIWIPETE, 3, monkeypatch, ASPIRATION_DEPTH=99) == reference
+    assert reference == ('e2a6', 0.15)
@@ -0,0 +1,50 @@
+# Search worker tests: python -m pytest
+import time
+import ChessEngine, ChessWorker
+from ChessPerft import PERFT_POSITIONS
+
+KIWIPETE = dict((name, fen) for name, fen, _ in PERFT_POSITIONS)['kiwipete']
+THINK_TIME = 0.5
+
+'''
+Wait for the search the worker is running and return (move, seconds it took)
+'''
+def waitForResult(worker, gs, start):
+    legalMoves = gs.generateLegalMoves()
+    while worker.searching:
+        move = worker.getResult(legalMoves)
+        if move is not None:
+            return move, time.perf_counter() - start
+        time.sleep(0.005)
+    raise AssertionError('search finished without a move')
+
+def playMove(worker, gs, notation):
+    move = next(move for move in gs.generateLegalMoves() if move.getChessNotation() == notation)
+    gs.makeMove(move)
+    worker.makeMove(move)
+
+'''
+With the parallel search the worker still knows the reply to ponder on, and after a ponder hit the next search answers
+with what the ponder search found instead of searching its time again
+'''
+def testPonderHitWithWorkers():
+    gs = ChessEngine.GameState.fromFEN(KIWIPETE)
+    worker = ChessWorker.SearchWorker(KIWIPETE, workers=2)
+    try:
+        worker.startSearch(THINK_TIME)
+        move, _ = waitForResult(worker, gs, time.perf_counter())
+        expected = worker.ponderMove
+        assert expected is not None
+        playMove(worker, gs, move.getChessNotation())
+
+        worker.startPonder()
+        time.sleep(3 * THINK_TIME) # The human thinks longer than the AI would
+        playMove(worker, gs, expected)
+        start = time.perf_counter()
+        worker.startSearch(THINK_TIME)
+        move, seconds = waitForResult(worker, gs, start)
+        assert move in gs.generateLegalMoves()
+        assert seconds < THINK_TIME / 2
+        assert worker.searchStats['depth'] > 0
+    finally:
+        worker.close()